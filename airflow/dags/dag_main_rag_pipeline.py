@@ -4,6 +4,8 @@ from datetime import datetime
 import requests
 
 FASTAPI_URL = "http://fastapi_service:8000"
+# Map-reduce over a long filing makes many LLM calls; give up well before the run looks stuck
+SUMMARY_TIMEOUT_SECONDS = 1800
 
 default_args = {
     "owner": "airflow",
@@ -27,11 +29,31 @@ def chunk_markdown(**kwargs):
         "year": config["year"],
         "quarter": config["quarter"],
         "parser": config["parser"],
-        "strategy": config["strategy"]
+        "strategy": config["strategy"],
+        "include_chunks": False
     }
 
+    # The backend stores the chunks as an artifact that the upload step reuses
     response = requests.post(f"{FASTAPI_URL}/chunk_markdown", json=payload)
     response.raise_for_status()
+    return response.json()["artifact_key"]
+
+def summarize_markdown(**kwargs):
+    config = kwargs["dag_run"].conf
+    payload = {
+        "year": config["year"],
+        "quarter": config["quarter"],
+        "parser": config["parser"]
+    }
+
+    # Map-reduce summary stored in S3 so the summary endpoints don't generate on click.
+    # Best effort: the summary endpoints still generate on demand when it is missing,
+    # so a failure here must not fail an ingest whose vectors uploaded fine.
+    try:
+        response = requests.post(f"{FASTAPI_URL}/summarize_markdown", json=payload, timeout=SUMMARY_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"⚠️ Precomputed summary failed, summaries will be generated on demand: {e}")
 
 def upload_to_vector_db(**kwargs):
     config = kwargs["dag_run"].conf
@@ -78,4 +100,10 @@ with DAG(
         provide_context=True
     )
 
-    task_process_pdf >> task_chunk_md >> task_vector_upload
+    task_summarize = PythonOperator(
+        task_id="summarize_markdown",
+        python_callable=summarize_markdown,
+        provide_context=True
+    )
+
+    task_process_pdf >> task_chunk_md >> [task_vector_upload, task_summarize]
@@ -0,0 +1,110 @@
+import time
+import json
+import random
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+# Concurrency load test for the query endpoints. Sends --requests requests at
+# each --concurrency level against a running backend and reports throughput
+# and latency percentiles (and time to first byte for streaming routes). Run
+# it against two builds to compare them, e.g.
+#
+#   python backend/load_test.py --url http://localhost:8000 --route /query_pinecone \
+#       --year 2024 --quarter Q1 --concurrency 1 8 32 64 --requests 200
+#
+# Requests are sent with "use_cache": false so the answer cache does not hide
+# the work being measured. backend/load_test_stub.py serves a build with
+# simulated retrieval and LLM latency for repeatable comparisons.
+
+DEFAULT_QUESTIONS = [
+    "What was total revenue for the quarter?",
+    "How did data center revenue change year over year?",
+    "What was diluted EPS?",
+    "What was gross margin?",
+    "How much cash came from operating activities?",
+    "What is the outlook for next quarter?",
+]
+
+async def timed_request(client, url, payload, stream):
+    start = time.perf_counter()
+    ttfb = None
+    if stream:
+        async with client.stream("POST", url, json=payload) as response:
+            async for _ in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+            ok = response.status_code == 200
+    else:
+        response = await client.post(url, json=payload)
+        ttfb = time.perf_counter() - start
+        ok = response.status_code == 200
+    return ok, ttfb, time.perf_counter() - start
+
+async def run_level(url, payloads, concurrency, stream, timeout):
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results = []
+
+    async def worker(client):
+        while not queue.empty():
+            payload = queue.get_nowait()
+            try:
+                results.append(await timed_request(client, url, payload, stream))
+            except httpx.HTTPError:
+                results.append((False, None, None))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies = np.array([r[2] for r in results if r[0]]) * 1000
+    ttfbs = np.array([r[1] for r in results if r[0]]) * 1000
+    percentile = lambda values, q: round(float(np.percentile(values, q)), 1) if len(values) else None
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r[0]),
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "ttfb_p50_ms": percentile(ttfbs, 50),
+        "ttfb_p95_ms": percentile(ttfbs, 95),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure query endpoint throughput at several concurrency levels.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--route", default="/query_pinecone", help="e.g. /query_chromadb or /query_manual/stream")
+    parser.add_argument("--year", required=True)
+    parser.add_argument("--quarter", required=True)
+    parser.add_argument("--parser", default="mistral")
+    parser.add_argument("--strategy", default="recursive")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--questions", help="File with one question per line")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    stream = args.route.endswith("/stream")
+    for concurrency in args.concurrency:
+        payloads = [{
+            "query": random.choice(questions),
+            "year": args.year,
+            "quarter": args.quarter,
+            "parser": args.parser,
+            "strategy": args.strategy,
+            "use_cache": False,
+        } for _ in range(args.requests)]
+        result = asyncio.run(run_level(args.url.rstrip("/") + args.route, payloads, concurrency, stream, args.timeout))
+        print(json.dumps(result))
@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import types
+import asyncio
+import argparse
+import subprocess
+import openai
+
+# Serves the backend with simulated retrieval and LLM latency, so
+# backend/load_test.py measures how the server handles concurrency rather
+# than the vector stores or the OpenAI account:
+#   python backend/load_test_stub.py --port 8000 --retrieval-ms 50 --embedding-ms 100 --llm-ms 3000
+#   python backend/load_test.py --url http://localhost:8000 --year 2024 --quarter Q1 --concurrency 1 32 128
+# Vector store searches block their thread for --retrieval-ms (like the sync
+# store SDKs) on every query route (Pinecone, ChromaDB and manual). Query
+# embeddings take the build's own path to embedding/stub_embedding_server.py,
+# started on --embedding-port with --embedding-ms of latency, and every
+# completion takes --llm-ms. To compare two builds, check the older one out
+# elsewhere (e.g. git worktree) and pass it as --app-dir.
+
+CHUNKS = ["Revenue grew 10% year over year.", "Gross margin was 70%."]
+
+def completion(text):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+def stream_chunk(text):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+
+class StubCompletions:
+    words = ["Revenue", " grew", " 10%", " on", " data", " center", " demand."]
+
+    def __init__(self, llm_seconds):
+        self.llm_seconds = llm_seconds
+
+    async def create(self, model=None, messages=None, stream=False, **kwargs):
+        if not stream:
+            await asyncio.sleep(self.llm_seconds)
+            return completion("".join(self.words))
+        return self._stream()
+
+    async def _stream(self):
+        for word in self.words:
+            await asyncio.sleep(self.llm_seconds / len(self.words))
+            yield stream_chunk(word)
+
+class BlockingCompletions:
+    # Builds that still call the synchronous OpenAI client
+    def __init__(self, llm_seconds):
+        self.llm_seconds = llm_seconds
+
+    def create(self, model=None, messages=None, **kwargs):
+        time.sleep(self.llm_seconds)
+        return completion("".join(StubCompletions.words))
+
+def patch_backend(main, retrieval_seconds, llm_seconds):
+    def search(*args, query_vector=None, **kwargs):
+        if query_vector is None:
+            # Builds that embed inside the search make this call on the request thread
+            openai.embeddings.create(model="text-embedding-3-small", input=["load test query"])
+        time.sleep(retrieval_seconds)
+        return list(CHUNKS)
+
+    # The search functions of this build, both as imported by backend.main and
+    # in their modules (older builds import them inside the route)
+    modules = [main] + [sys.modules.get(name) for name in ("embedding.pinecone", "embedding.chromadb", "embedding.manual")]
+    for module in filter(None, modules):
+        for name in ("search_chunks", "search_chroma_chunks", "search_manual_vectors"):
+            if hasattr(module, name):
+                setattr(module, name, search)
+    if hasattr(main, "answer_cache"):
+        # Older builds ignore "use_cache": false
+        main.answer_cache.get = lambda *args: None
+    if hasattr(main, "stored_summary"):
+        main.stored_summary = lambda *args: None
+
+    if hasattr(main, "AsyncOpenAI"):
+        class StubAsyncOpenAI(main.AsyncOpenAI):
+            # Real client (embeddings go to the stub server), simulated completions
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                self.chat = types.SimpleNamespace(completions=StubCompletions(llm_seconds))
+        main.AsyncOpenAI = StubAsyncOpenAI
+    # Builds that still call the synchronous OpenAI client or module
+    blocking_chat = types.SimpleNamespace(completions=BlockingCompletions(llm_seconds))
+    if hasattr(main, "client"):
+        main.client = types.SimpleNamespace(chat=blocking_chat)
+    openai.chat = blocking_chat
+
+def start_embedding_server(port, delay_seconds):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "embedding.stub_embedding_server", "--port", str(port), "--delay", str(delay_seconds)],
+        cwd=root, stdout=subprocess.DEVNULL,
+    )
+    time.sleep(1)
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the backend with simulated retrieval and LLM latency for load tests.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--retrieval-ms", type=float, default=50, help="Blocking retrieval time per request.")
+    parser.add_argument("--embedding-ms", type=float, default=100, help="Stub embedding server latency per request.")
+    parser.add_argument("--embedding-port", type=int, default=8100)
+    parser.add_argument("--llm-ms", type=float, default=3000, help="Completion time per request.")
+    parser.add_argument("--app-dir", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help="Checkout whose backend/main.py is served.")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"http://localhost:{args.embedding_port}/v1"
+    embedding_server = start_embedding_server(args.embedding_port, args.embedding_ms / 1000)
+    try:
+        sys.path.insert(0, args.app_dir)
+        import backend.main as main
+        import uvicorn
+
+        patch_backend(main, args.retrieval_ms / 1000, args.llm_ms / 1000)
+        print(f"🧪 Stub backend from {args.app_dir} on http://localhost:{args.port} "
+              f"(retrieval {args.retrieval_ms:.0f} ms, embedding {args.embedding_ms:.0f} ms, LLM {args.llm_ms:.0f} ms)")
+        uvicorn.run(main.app, host="0.0.0.0", port=args.port, log_level="warning")
+    finally:
+        embedding_server.terminate()
@@ -1,27 +1,43 @@
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import boto3
 import os
 import sys
 from dotenv import load_dotenv
 import json
-import openai
 # Add root path to Python path to allow relative imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import traceback
 # Import processing functions
 from pdf_processing.mistral import mistral_pdf_to_md
 #from pdf_processing.docling_extract import convert_pdf_to_markdown
-from chunking.chunks import heading_based_split, semantic_split, recursive_split
+from chunking.artifacts import ensure_chunk_artifact
+from chunking.summaries import ensure_document_summary, load_document_summary
 from embedding.pinecone import process_and_upload_to_pinecone
 from embedding.chromadb import process_and_upload_to_chromadb
-from embedding.pinecone import search_chunks
-from openai import OpenAI
+from embedding.pinecone import search_chunks, search_chunks_batch, upsert_stats
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from fastapi import Request
 from embedding.chromadb import search_chunks as search_chroma_chunks
-from embedding.manual import search_manual_vectors
-import requests
+from embedding.chromadb import search_chunks_batch as search_chroma_chunks_batch
+from embedding.manual import search_manual_vectors, search_manual_vectors_batch
+from embedding.cache import embedding_cache
+from embedding.query_cache import query_cache, warm_query_cache, embed_query_async, embed_queries_async, SUMMARY_PROBES
+from embedding.answer_cache import answer_cache, answer_key
+from embedding.index_cache import index_cache
+from embedding.context import pack_context
 import asyncio
+import random
+import httpx
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from functools import partial
+import time
+import threading
+import numpy as np
 import logging
 # Load .env variables
 load_dotenv()
@@ -32,8 +48,36 @@ AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 AWS_BUCKET = os.getenv("AWS_BUCKET_NAME")
 
+# Shared clients: one connection pool per upstream for the whole process,
+# opened and closed by the app lifespan and reached through app.state.
+# boto3 has no async API, so S3 calls run on their own executor sized to the
+# S3 client's connection pool instead of the request threadpool.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 120))
+
+@asynccontextmanager
+async def lifespan(app):
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS // 5)
+    app.state.http = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0))
+    app.state.openai = AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        http_client=DefaultAsyncHttpxClient(limits=limits)
+    )
+    app.state.s3_pool = ThreadPoolExecutor(max_workers=S3_MAX_POOL_CONNECTIONS, thread_name_prefix="s3")
+    await run_in_threadpool(precompute_query_embeddings)
+    try:
+        yield
+    finally:
+        for watch in list(dag_watches.values()):
+            watch.task.cancel()
+        await app.state.openai.close()
+        await app.state.http.aclose()
+        app.state.s3_pool.shutdown(wait=False)
+
 # FastAPI app setup
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for frontend integration
 app.add_middleware(
@@ -48,30 +92,70 @@ s3_client = boto3.client(
     "s3",
     region_name=AWS_REGION,
     aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY
+    aws_secret_access_key=AWS_SECRET_KEY,
+    config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
 )
 
+async def s3_call(method, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.s3_pool, partial(getattr(s3_client, method), **kwargs))
+
+async def s3_read(key):
+    # Reading the body is blocking too, so fetch and read in one executor call
+    loop = asyncio.get_running_loop()
+    read = lambda: s3_client.get_object(Bucket=AWS_BUCKET, Key=key)["Body"].read()
+    return await loop.run_in_executor(app.state.s3_pool, read)
+
+def precompute_query_embeddings():
+    # Embed the fixed summary probe once so summary requests skip that round trip
+    try:
+        warm_query_cache()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"⚠️ Could not precompute probe embeddings: {e}")
+
 # ----------------------- ROUTES -----------------------
 
 @app.get("/get_available_years")
-def get_available_years():
-    response = s3_client.list_objects_v2(Bucket=AWS_BUCKET, Prefix="Raw_PDFs/", Delimiter="/")
+async def get_available_years():
+    response = await s3_call("list_objects_v2", Bucket=AWS_BUCKET, Prefix="Raw_PDFs/", Delimiter="/")
     years = [prefix["Prefix"].split("/")[-2] for prefix in response.get("CommonPrefixes", [])]
     return {"years": sorted(years, reverse=True)}
 
 @app.get("/get_available_quarters/{year}")
-def get_available_quarters(year: str):
+async def get_available_quarters(year: str):
     prefix = f"Raw_PDFs/{year}/"
-    response = s3_client.list_objects_v2(Bucket=AWS_BUCKET, Prefix=prefix)
+    response = await s3_call("list_objects_v2", Bucket=AWS_BUCKET, Prefix=prefix)
     quarters = [obj["Key"].split("/")[-1].replace(".pdf", "") for obj in response.get("Contents", []) if obj["Key"].endswith(".pdf")]
     return {"quarters": sorted(quarters)}
 
 @app.get("/get_pdf_url/{year}/{quarter}")
-def get_pdf_url(year: str, quarter: str):
+async def get_pdf_url(year: str, quarter: str):
+    # Presigning is local, no request to S3
     s3_key = f"Raw_PDFs/{year}/{quarter}.pdf"
     url = s3_client.generate_presigned_url("get_object", Params={"Bucket": AWS_BUCKET, "Key": s3_key}, ExpiresIn=3600)
     return {"pdf_url": url}
 
+@app.get("/embedding_cache_stats")
+def embedding_cache_stats():
+    return {**embedding_cache.stats(), "query_cache": query_cache.stats()}
+
+@app.get("/index_cache_stats")
+def index_cache_stats():
+    return index_cache.stats()
+
+@app.get("/answer_cache_stats")
+def answer_cache_stats():
+    return answer_cache.stats()
+
+def invalidate_answers(store, parser, strategy, year, quarter, result):
+    # Cached answers for a filing are stale once its chunks changed
+    if result.get("chunks_uploaded") or result.get("chunks_deleted"):
+        answer_cache.invalidate(store, parser, strategy, year, quarter)
+
+@app.get("/pinecone_upsert_stats")
+def pinecone_upsert_stats():
+    return upsert_stats.stats()
+
 @app.post("/process_pdf_mistral/{year}/{quarter}")
 def process_pdf_with_mistral(year: str, quarter: str):
     s3_key = f"Raw_PDFs/{year}/{quarter}.pdf"
@@ -90,30 +174,24 @@ logging.basicConfig(level=logging.INFO)
 
 
 from fastapi import HTTPException
-import requests
 import os
-import tempfile
 import traceback
 import logging
 
 logger = logging.getLogger(__name__)
 
+DOCLING_URL = os.getenv("DOCLING_URL", "http://docling_service:8001")
+DOCLING_TIMEOUT = float(os.getenv("DOCLING_TIMEOUT", 600))
+
 @app.post("/process_pdf_docling/{year}/{quarter}")
-def process_pdf_docling(year: str, quarter: str):
+async def process_pdf_docling(year: str, quarter: str):
     s3_key = f"Raw_PDFs/{year}/{quarter}.pdf"
 
     try:
         # Step 1: Download PDF from S3
         logger.info(f"📥 Attempting to download PDF from S3: {s3_key}")
-        response = s3_client.get_object(Bucket=AWS_BUCKET, Key=s3_key)
-        logger.info("✅ Successfully fetched PDF stream from S3")
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(response["Body"].read())
-            tmp_file_path = tmp_file.name
-
-        file_size = os.path.getsize(tmp_file_path) / 1e6
-        logger.info(f"✅ Saved PDF to temp file: {tmp_file_path} ({file_size:.2f} MB)")
+        pdf_bytes = await s3_read(s3_key)
+        logger.info(f"✅ Fetched PDF from S3 ({len(pdf_bytes) / 1e6:.2f} MB)")
 
     except Exception as e:
         logger.error(f"❌ Failed to fetch PDF from S3: {e}")
@@ -121,12 +199,11 @@ def process_pdf_docling(year: str, quarter: str):
 
     try:
         # Step 2: Forward to docling_service running on port 8001
-        docling_url = f"http://docling_service:8001/convert_docling/{year}/{quarter}"
+        docling_url = f"{DOCLING_URL}/convert_docling/{year}/{quarter}"
         logger.info(f"📤 Sending PDF to Docling service at {docling_url}")
 
-        with open(tmp_file_path, "rb") as f:
-            files = {"file": (f"{quarter}.pdf", f, "application/pdf")}
-            docling_response = requests.post(docling_url, files=files)
+        files = {"file": (f"{quarter}.pdf", pdf_bytes, "application/pdf")}
+        docling_response = await app.state.http.post(docling_url, files=files, timeout=DOCLING_TIMEOUT)
 
         docling_response.raise_for_status()
         logger.info(f"✅ Received successful response from Docling service.")
@@ -141,15 +218,6 @@ def process_pdf_docling(year: str, quarter: str):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"❌ Docling service failed: {str(e)}")
 
-    finally:
-        # Clean up the temporary file
-        try:
-            if os.path.exists(tmp_file_path):
-                os.remove(tmp_file_path)
-                logger.info(f"🧹 Cleaned up temp file: {tmp_file_path}")
-        except Exception as cleanup_error:
-            logger.warning(f"⚠️ Failed to delete temp file: {tmp_file_path}. Error: {cleanup_error}")
-
 
 @app.post("/chunk_markdown")
 def chunk_markdown(payload: dict):
@@ -169,17 +237,47 @@ def chunk_markdown(payload: dict):
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Markdown file not found in S3: {e}")
 
-    # Apply selected chunking strategy
-    if strategy == "heading":
-        chunks = heading_based_split(md_content)
-    elif strategy == "semantic":
-        chunks = semantic_split(md_content)
-    elif strategy == "recursive":
-        chunks = recursive_split(md_content)
-    else:
+    # Chunk once and persist the artifact next to the markdown; the upload
+    # endpoints reuse it instead of chunking again.
+    try:
+        artifact_key, records, cached = ensure_chunk_artifact(md_content, year, quarter, parser, strategy)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid chunking strategy.")
 
-    return {"chunks": chunks}
+    result = {"artifact_key": artifact_key, "chunks_created": len(records), "cached": cached}
+    if payload.get("include_chunks", True):
+        result["chunks"] = [record["text"] for record in records]
+    return result
+
+@app.post("/summarize_markdown")
+def summarize_markdown(payload: dict):
+    year = payload.get("year")
+    quarter = payload.get("quarter")
+    parser = payload.get("parser", "mistral").lower()
+
+    if not all([year, quarter, parser]):
+        raise HTTPException(status_code=400, detail="Missing required parameters.")
+
+    try:
+        print(f"🗺️ Precomputing summary — {year} {quarter} | {parser}")
+        summary = ensure_document_summary(year, quarter, parser)
+        return {"status": "success", "markdown_sha256": summary["markdown_sha256"],
+                "sections": len(summary["section_summaries"])}
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+def stored_summary(year, quarter, parser):
+    # Served from the summary precomputed at ingestion; None falls back to on-demand generation
+    try:
+        stored = load_document_summary(year, quarter, parser.lower())
+    except Exception as e:
+        print(f"⚠️ Could not read precomputed summary: {e}")
+        return None
+    if stored:
+        print(f"⚡ Serving precomputed summary for {year} {quarter} {parser}")
+        return {"summary": stored["summary"], "source_chunks": [], "precomputed": True}
+    return None
 
 @app.post("/upload_to_pinecone")
 def trigger_pinecone(payload: dict):
@@ -194,6 +292,7 @@ def trigger_pinecone(payload: dict):
     try:
         print(f"🚀 Uploading to Pinecone — {year} {quarter} | {parser} | {strategy}")
         result = process_and_upload_to_pinecone(year, quarter, parser, strategy)
+        invalidate_answers("pinecone", parser, strategy, year, quarter, result)
         print(f"✅ Upload completed: {result}")
         return result
     except Exception as e:
@@ -219,7 +318,8 @@ def trigger_chromadb(payload: dict):
 
     try:
         print(f"🚀 Uploading to ChromaDB: {year} {quarter}, {parser}, {strategy}")
-        result = process_and_upload_to_chromadb(year, quarter, parser, strategy)
+        result = process_and_upload_to_chromadb(year, quarter, parser, strategy, hnsw=payload.get("hnsw"))
+        invalidate_answers("chromadb", parser, strategy, year, quarter, result)
         return result
     except Exception as e:
         import traceback
@@ -232,166 +332,410 @@ def trigger_chromadb(payload: dict):
 
 
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
-client = OpenAI()
-
-@app.post("/query_pinecone")
-def query_pinecone(payload: dict):
+# ----------------------- QUERY + SUMMARY -----------------------
+# The JSON routes (/query_*, /generate_summary_*) and their streaming variants
+# (.../stream, server-sent events) share retrieval, prompts and caching below.
+# Retrieval goes through blocking SDKs (OpenAI embeddings, Pinecone, Chroma,
+# S3) and runs in the threadpool; the LLM call is awaited on the shared async
+# client, so a request holds no thread while the answer is generated.
+STORES = ("pinecone", "chromadb", "manual")
+LLM_MODEL = "gpt-4o-mini"
+
+QUERY_PROMPTS = {
+    "pinecone": ("You are an expert in financial document analysis.",
+                 "Given this context:\n{context}\n\nAnswer this question:\n{query}"),
+    "chromadb": ("You are a financial analyst answering questions based on extracted financial reports. Use only the given context.",
+                 "Context:\n{context}\n\nQuestion:\n{query}"),
+    "manual": ("You are a financial analyst using internal document chunks.",
+               "Context:\n{context}\n\nQuestion:\n{query}"),
+}
+
+SUMMARY_PROMPTS = {
+    "pinecone": ("You are a professional financial analyst. Summarize the document.",
+                 "Based on this document, give me a detailed executive summary:\n{context}"),
+    "chromadb": ("You are a financial analyst. Summarize the key points of this financial report accurately and concisely.",
+                 "Please summarize the following report content:\n{context}"),
+    "manual": ("You are a financial analyst. Generate an executive summary from this content.",
+               "{context}"),
+}
+
+def build_messages(prompts, store, context, query=None):
+    system, template = prompts[store]
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": template.format(context=context, query=query)}
+    ]
+
+# Manual queries with year and/or quarter set to "all" search every ingested
+# filing through the corpus-wide ANN index; "nprobe" tunes its recall.
+ALL_FILINGS = "all"
+
+def corpus_wide(store, payload, quarters):
+    return store == "manual" and ALL_FILINGS in (payload["year"], quarters[0])
+
+def retrieve_chunks(store, payload, query, quarters, mode="vector", query_vector=None):
+    parser, strategy, year = payload["parser"], payload["strategy"], payload["year"]
+    if store == "pinecone":
+        return search_chunks(parser, strategy, query, year, quarters, mode=mode, query_vector=query_vector)
+    if store == "chromadb":
+        return search_chroma_chunks(parser, strategy, query, year, quarters, top_k=30, mode=mode, query_vector=query_vector)
+    year, quarter = (None if value == ALL_FILINGS else value for value in (year, quarters[0]))
+    return search_manual_vectors(query, parser, strategy, year, quarter, top_k=30, nprobe=payload.get("nprobe"),
+                                 mode=mode, query_vector=query_vector)
+
+async def embed_request_query(payload, query):
+    """Embed the query with the async client before retrieval runs in the threadpool; lexical queries skip it."""
+    if payload.get("mode", "vector") == "lexical":
+        return None
+    return await embed_query_async(app.state.openai, query)
+
+def lookup_answer(store, payload, quarters, query_vector):
+    """
+    Return (key, cached) for the semantic answer cache; lexical and
+    corpus-wide manual queries skip it.
+    """
+    mode = payload.get("mode", "vector")
+    if mode == "lexical" or payload.get("use_cache") is False or corpus_wide(store, payload, quarters):
+        return None, None
+    key = answer_key(store, payload["parser"].lower(), payload["strategy"].lower(), payload["year"], quarters, mode)
+    cached = answer_cache.get(key, query_vector)
+    if cached:
+        print(f"⚡ Answer cache hit for {store} (similarity {cached['similarity']})")
+    return key, cached
+
+def query_request(store, payload):
+    """Validate a query payload; returns (query, quarters)."""
     query = payload.get("query")
-    year = payload.get("year")
-    quarter = payload.get("quarter")
-    parser = payload.get("parser")
-    strategy = payload.get("strategy")
-
-    if not all([query, year, quarter, parser, strategy]):
+    # "quarters" (e.g. ["Q1", "Q2", "Q3", "Q4"]) searches several periods at once; manual takes one
+    quarters = [payload.get("quarter")]
+    if store != "manual":
+        quarters = payload.get("quarters") or quarters
+    if not all([query, payload.get("year"), *quarters, payload.get("parser"), payload.get("strategy")]):
         raise HTTPException(status_code=400, detail="Missing query parameters")
+    return query, quarters
 
+def summary_request(payload):
+    if not all([payload.get("year"), payload.get("quarter"), payload.get("parser"), payload.get("strategy")]):
+        raise HTTPException(status_code=400, detail="Missing summary parameters")
+    if ALL_FILINGS in (payload["year"], payload["quarter"]):
+        raise HTTPException(status_code=400, detail="Summaries need a single filing")
+
+def prepare_query(store, payload, query, quarters, query_vector):
+    """Return (cached, key, sources, messages); cached answers skip retrieval."""
+    print(f"📥 [{store}] Query: {query}")
+    print(f"📌 Filters — Year: {payload['year']}, Quarters: {quarters}, Parser: {payload['parser']}, Strategy: {payload['strategy']}")
+    key, cached = lookup_answer(store, payload, quarters, query_vector)
+    if cached:
+        return cached, key, None, None
+
+    chunks = retrieve_chunks(store, payload, query, quarters, payload.get("mode", "vector"), query_vector)
+    print(f"✅ Retrieved {len(chunks)} chunks from {store}")
+    if not chunks:
+        raise ValueError("No relevant chunks retrieved. Check your vector store.")
+    context, chunks = pack_context(chunks, payload.get("context_tokens"), payload["strategy"])
+    if not context.strip():
+        raise ValueError("Retrieved chunks produced an empty context.")
+    return None, key, chunks, build_messages(QUERY_PROMPTS, store, context, query)
+
+# Summaries retrieve with a fixed probe, pinned in the query cache at startup
+SUMMARY_QUERY = SUMMARY_PROBES[0]
+
+def prepare_summary(store, payload, query_vector):
+    """Return (stored, sources, messages); a precomputed summary skips retrieval."""
+    year, quarter, parser = payload["year"], payload["quarter"], payload["parser"]
+    print(f"📝 Generating Summary — {year} {quarter} | {parser} | {payload['strategy']} ({store})")
+    stored = stored_summary(year, quarter, parser)
+    if stored:
+        return stored, None, None
+
+    chunks = retrieve_chunks(store, payload, SUMMARY_QUERY, [quarter], query_vector=query_vector)
+    if not chunks:
+        raise ValueError("No chunks found for summary generation.")
+    context, chunks = pack_context(chunks, payload.get("context_tokens"), payload["strategy"])
+    if not context.strip():
+        raise ValueError("Retrieved chunks produced an empty context.")
+    return None, chunks, build_messages(SUMMARY_PROMPTS, store, context)
+
+async def complete(messages):
+    completion = await app.state.openai.chat.completions.create(model=LLM_MODEL, messages=messages)
+    return completion.choices[0].message.content
+
+async def answer_query(store, payload):
+    query, quarters = query_request(store, payload)
     try:
-        print(f"📥 Query Received: {query}")
-        print(f"📌 Filters — Year: {year}, Quarter: {quarter}, Parser: {parser}, Strategy: {strategy}")
-        chunks = search_chunks(parser, strategy, query, year, [quarter])
-        print(f"✅ Retrieved {len(chunks)} chunks from Pinecone")
-
-        if not chunks:
-            raise ValueError("No relevant chunks retrieved. Check your vector store.")
-
-        context = "\n\n".join(chunks)
-
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert in financial document analysis."},
-                {"role": "user", "content": f"Given this context:\n{context}\n\nAnswer this question:\n{query}"}
-            ]
-        )
-
-        answer = completion.choices[0].message.content
-        return {"answer": answer, "sources": chunks}
-
+        query_vector = await embed_request_query(payload, query)
+        cached, key, chunks, messages = await run_in_threadpool(prepare_query, store, payload, query, quarters, query_vector)
+        if cached:
+            return {**cached, "cached": True}
+        result = {"answer": await complete(messages), "sources": chunks}
+        if key:
+            answer_cache.put(key, query_vector, result)
+        return result
     except Exception as e:
-        import traceback
+        print(f"❌ Error in /query_{store}:", e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate_summary_pinecone")
-def generate_summary_pinecone(payload: dict):
-    year = payload.get("year")
-    quarter = payload.get("quarter")
-    parser = payload.get("parser")
-    strategy = payload.get("strategy")
-
-    if not all([year, quarter, parser, strategy]):
-        raise HTTPException(status_code=400, detail="Missing summary parameters")
-
+async def summarize(store, payload):
+    summary_request(payload)
     try:
-        print(f"📝 Generating Summary — {year} {quarter} | {parser} | {strategy}")
-        chunks = search_chunks(parser, strategy, "summary", year, [quarter])
-        if not chunks:
-            raise ValueError("No chunks found for summary generation.")
-
-        context = "\n\n".join(chunks)
-
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a professional financial analyst. Summarize the document."},
-                {"role": "user", "content": f"Based on this document, give me a detailed executive summary:\n{context}"}
-            ]
-        )
-
-        summary = completion.choices[0].message.content
-        return {"summary": summary}
-
+        query_vector = await embed_query_async(app.state.openai, SUMMARY_QUERY)
+        stored, chunks, messages = await run_in_threadpool(prepare_summary, store, payload, query_vector)
+        if stored:
+            return stored
+        return {"summary": await complete(messages), "source_chunks": chunks}
     except Exception as e:
-        import traceback
+        print(f"❌ Error in /generate_summary_{store}:", e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query_pinecone")
+async def query_pinecone(payload: dict):
+    return await answer_query("pinecone", payload)
 
-
-
-
-
+@app.post("/generate_summary_pinecone")
+async def generate_summary_pinecone(payload: dict):
+    return await summarize("pinecone", payload)
 
 @app.post("/query_chromadb")
-def query_chromadb(payload: dict):
-    query = payload.get("query")
-    year = payload.get("year")
-    quarter = payload.get("quarter")
-    parser = payload.get("parser")
-    strategy = payload.get("strategy")
+async def query_chromadb(payload: dict):
+    return await answer_query("chromadb", payload)
 
-    if not all([query, year, quarter, parser, strategy]):
-        raise HTTPException(status_code=400, detail="Missing query parameters")
+@app.post("/generate_summary_chromadb")
+async def summarize_chromadb(payload: dict):
+    return await summarize("chromadb", payload)
 
-    try:
-        print(f"📥 [ChromaDB] Query: {query}")
-        from embedding.chromadb import search_chunks as search_chroma_chunks
-        chunks = search_chroma_chunks(parser, strategy, query, year, [quarter], top_k=30)
-
-        context = "\n\n".join(chunks)
-        max_chars = 15000
-        if len(context) > max_chars:
-            print(f"⚠️ Context too long ({len(context)} chars), trimming...")
-            context = context[:max_chars]
-
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a financial analyst answering questions based on extracted financial reports. Use only the given context."},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion:\n{query}"}
-            ]
-        )
-        answer = completion.choices[0].message.content
-        return {"answer": answer, "sources": chunks}
+@app.post("/query_manual")
+async def query_manual(payload: dict):
+    return await answer_query("manual", payload)
 
+@app.post("/generate_summary_manual")
+async def generate_summary_manual(payload: dict):
+    return await summarize("manual", payload)
+
+# ----------------------- STREAMING -----------------------
+# Server-sent events: "sources" first (as soon as retrieval is done), then one
+# "token" event per completion delta, then "done" with timings. Time to first
+# byte (the sources event) and to the first token are tracked per route.
+class StreamStats:
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, metric, ms):
+        with self._lock:
+            samples = self._samples.setdefault(route, {}).setdefault(metric, [])
+            samples.append(ms)
+            del samples[:-self.window]
+
+    def stats(self):
+        with self._lock:
+            return {
+                route: {
+                    metric: {"count": len(samples), "p50_ms": round(float(np.percentile(samples, 50)), 1),
+                             "p95_ms": round(float(np.percentile(samples, 95)), 1)}
+                    for metric, samples in metrics.items()
+                }
+                for route, metrics in self._samples.items()
+            }
+
+stream_stats = StreamStats()
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_answer(route, prepare, on_complete=None):
+    """
+    await prepare() -> (text, sources, messages): a ready answer (text) or
+    the messages to stream from the LLM.
+    """
+    start = time.perf_counter()
+    elapsed = lambda: (time.perf_counter() - start) * 1000
+    try:
+        text, sources, messages = await prepare()
+        yield sse("sources", {"sources": sources or []})
+        ttfb = elapsed()
+        stream_stats.record(route, "ttfb", ttfb)
+
+        if text is not None:
+            stream_stats.record(route, "first_token", elapsed())
+            yield sse("token", {"text": text})
+        else:
+            parts = []
+            stream = await app.state.openai.chat.completions.create(model=LLM_MODEL, messages=messages, stream=True)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    stream_stats.record(route, "first_token", elapsed())
+                parts.append(delta)
+                yield sse("token", {"text": delta})
+            if on_complete:
+                on_complete("".join(parts), sources)
+
+        stream_stats.record(route, "total", elapsed())
+        yield sse("done", {"ttfb_ms": round(ttfb, 1), "total_ms": round(elapsed(), 1)})
     except Exception as e:
-        print("❌ Error in /query_chromadb:", e)
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/generate_summary_chromadb")
-def summarize_chromadb(payload: dict):
-    year = payload.get("year")
-    quarter = payload.get("quarter")
-    parser = payload.get("parser")
-    strategy = payload.get("strategy")
-
-    if not all([year, quarter, parser, strategy]):
-        raise HTTPException(status_code=400, detail="Missing parameters")
+        yield sse("error", {"detail": str(e)})
+
+def stream_response(events):
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/query_{store}/stream")
+async def query_stream(store: str, payload: dict):
+    if store not in STORES:
+        raise HTTPException(status_code=404, detail=f"Unknown store: {store}")
+    query, quarters = query_request(store, payload)
+    state = {}
+
+    async def prepare():
+        state["vector"] = await embed_request_query(payload, query)
+        cached, state["key"], chunks, messages = await run_in_threadpool(prepare_query, store, payload, query, quarters, state["vector"])
+        if cached:
+            return cached["answer"], cached["sources"], None
+        return None, chunks, messages
+
+    def on_complete(answer, sources):
+        if state["key"]:
+            answer_cache.put(state["key"], state["vector"], {"answer": answer, "sources": sources})
+
+    return stream_response(stream_answer(f"query_{store}", prepare, on_complete))
+
+@app.post("/generate_summary_{store}/stream")
+async def summary_stream(store: str, payload: dict):
+    if store not in STORES:
+        raise HTTPException(status_code=404, detail=f"Unknown store: {store}")
+    summary_request(payload)
+
+    async def prepare():
+        query_vector = await embed_query_async(app.state.openai, SUMMARY_QUERY)
+        stored, chunks, messages = await run_in_threadpool(prepare_summary, store, payload, query_vector)
+        if stored:
+            return stored["summary"], stored["source_chunks"], None
+        return None, chunks, messages
+
+    return stream_response(stream_answer(f"summary_{store}", prepare))
+
+@app.get("/stream_stats")
+def get_stream_stats():
+    return stream_stats.stats()
+
+# ----------------------- BATCH QA -----------------------
+# Many questions about one filing: all questions are embedded in one request,
+# retrieved with one batched search (a matrix product for manual, a
+# multi-vector query for Chroma, concurrent queries for Pinecone), and
+# answered with at most BATCH_LLM_CONCURRENCY completions in flight. Answers
+# stream back as server-sent "answer" events in completion order, each
+# carrying its question's index.
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 500))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))
+
+def retrieve_batch(store, payload, vectors):
+    parser, strategy, year, quarter = payload["parser"], payload["strategy"], payload["year"], payload["quarter"]
+    if store == "pinecone":
+        return search_chunks_batch(parser, strategy, vectors, year, quarter)
+    if store == "chromadb":
+        return search_chroma_chunks_batch(parser, strategy, vectors, year, quarter, top_k=30)
+    return search_manual_vectors_batch(vectors, parser, strategy, year, quarter, top_k=30)
+
+def prepare_batch(store, payload, questions, vectors):
+    """Return one item per question: {"cached": answer} or {"messages", "sources"}."""
+    key = None
+    if payload.get("use_cache") is not False:
+        key = answer_key(store, payload["parser"].lower(), payload["strategy"].lower(), payload["year"], [payload["quarter"]], "vector")
+
+    # Answered questions skip retrieval; only the cache misses are searched
+    items = [{"cached": answer_cache.get(key, vector)} if key else {} for vector in vectors]
+    misses = [i for i, item in enumerate(items) if not item.get("cached")]
+    retrieved = retrieve_batch(store, payload, [vectors[i] for i in misses]) if misses else []
+    for i, chunks in zip(misses, retrieved):
+        context, chunks = pack_context(chunks, payload.get("context_tokens"), payload["strategy"])
+        items[i] = {
+            "messages": build_messages(QUERY_PROMPTS, store, context, questions[i]) if context.strip() else None,
+            "sources": chunks,
+            "key": key,
+            "vector": vectors[i],
+        }
+    return items
 
+async def stream_batch(store, payload, questions, concurrency):
+    start = time.perf_counter()
     try:
-        from embedding.chromadb import search_chunks as search_chroma_chunks
-        chunks = search_chroma_chunks(parser, strategy, "summary", year, [quarter], top_k=30)
-
-        context = "\n\n".join(chunks)
-        max_chars = 15000
-        if len(context) > max_chars:
-            print(f"⚠️ Summary context too long ({len(context)} chars), trimming...")
-            context = context[:max_chars]
-
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a financial analyst. Summarize the key points of this financial report accurately and concisely."},
-                {"role": "user", "content": f"Please summarize the following report content:\n{context}"}
-            ]
-        )
-        summary = completion.choices[0].message.content
-        return {"summary": summary, "source_chunks": chunks}
-
+        vectors = await embed_queries_async(app.state.openai, questions)
+        items = await run_in_threadpool(prepare_batch, store, payload, questions, vectors)
     except Exception as e:
-        print("❌ Error in /generate_summary_chromadb:", e)
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        yield sse("error", {"detail": str(e)})
+        return
+    print(f"📦 Batch of {len(questions)} questions retrieved in {time.perf_counter() - start:.2f}s")
+    yield sse("retrieved", {"questions": len(questions), "ms": round((time.perf_counter() - start) * 1000, 1)})
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(i):
+        item, result = items[i], {"index": i, "question": questions[i]}
+        if "cached" in item:
+            return {**result, "answer": item["cached"]["answer"], "sources": item["cached"]["sources"], "cached": True}
+        if item["messages"] is None:
+            return {**result, "error": "No relevant chunks retrieved."}
+        try:
+            async with semaphore:
+                text = await complete(item["messages"])
+        except Exception as e:
+            return {**result, "error": str(e)}
+        if item["key"]:
+            answer_cache.put(item["key"], item["vector"], {"answer": text, "sources": item["sources"]})
+        return {**result, "answer": text, "sources": item["sources"]}
+
+    tasks = [asyncio.create_task(answer(i)) for i in range(len(questions))]
+    failed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            failed += "error" in result
+            yield sse("answer", result)
+    finally:
+        # Stop outstanding completions if the client went away
+        for task in tasks:
+            task.cancel()
+    yield sse("done", {"answered": len(questions) - failed, "failed": failed,
+                       "seconds": round(time.perf_counter() - start, 2)})
+
+@app.post("/batch_query/{store}")
+async def batch_query(store: str, payload: dict):
+    """
+    Body: {"questions": [...], "year", "quarter", "parser", "strategy",
+    optional "concurrency" (capped at BATCH_LLM_CONCURRENCY), "context_tokens",
+    "use_cache"}.
+    """
+    if store not in STORES:
+        raise HTTPException(status_code=404, detail=f"Unknown store: {store}")
+    questions = payload.get("questions")
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        raise HTTPException(status_code=400, detail="questions must be a non-empty list of strings")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    if not all([payload.get("year"), payload.get("quarter"), payload.get("parser"), payload.get("strategy")]):
+        raise HTTPException(status_code=400, detail="Missing query parameters")
+    if payload.get("mode", "vector") != "vector":
+        raise HTTPException(status_code=400, detail="Batch QA supports vector retrieval only")
+    if ALL_FILINGS in (payload["year"], payload["quarter"]):
+        raise HTTPException(status_code=400, detail="Batch QA needs a single filing")
+
+    concurrency = payload.get("concurrency") or BATCH_LLM_CONCURRENCY
+    if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be a positive integer")
+    concurrency = min(concurrency, BATCH_LLM_CONCURRENCY)
+    print(f"📦 [{store}] Batch of {len(questions)} questions — {payload['year']} {payload['quarter']} | {payload['parser']} | {payload['strategy']}")
+    return stream_response(stream_batch(store, payload, questions, concurrency))
 
 #Manual embedding
 @app.post("/upload_to_manual")
-def upload_to_manual(payload: dict):
-    from embedding.manual import create_manual_vector_index
+def upload_to_manual(payload: dict, background_tasks: BackgroundTasks):
+    from embedding.manual import create_manual_vector_index, compact_segments, build_manual_ann_index
     from embedding.pinecone import load_markdown  # reusing your loader
 
     year = payload.get("year")
@@ -408,110 +752,159 @@ def upload_to_manual(payload: dict):
         if not markdown:
             raise HTTPException(status_code=404, detail="Markdown not found in S3")
         result = create_manual_vector_index(markdown, year, quarter, parser, strategy)
-        return {"status": "success", "chunks_uploaded": len(result)}
-    except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/query_manual")
-def query_manual(payload: dict):
-    from embedding.manual import search_manual_vectors
-
-    query = payload.get("query")
-    year = payload.get("year")
-    quarter = payload.get("quarter")
-    parser = payload.get("parser")
-    strategy = payload.get("strategy")
-
-    if not all([query, year, quarter, parser, strategy]):
-        raise HTTPException(status_code=400, detail="Missing query parameters")
-
-    try:
-        print(f"🔎 Manual RAG query: {query}")
-        chunks = search_manual_vectors(query, parser, strategy, year, quarter, top_k=30)
-
-        context = "\n\n".join(chunks)
-        if len(context) > 15000:
-            context = context[:15000]
-
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a financial analyst using internal document chunks."},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion:\n{query}"}
-            ]
-        )
-        answer = completion.choices[0].message.content
-        return {"answer": answer, "sources": chunks}
-
+        invalidate_answers("manual", parser.lower(), strategy.lower(), year, quarter, result)
+        # Merge small segments and purge retired ones after the response is sent
+        background_tasks.add_task(compact_segments, year, quarter)
+        background_tasks.add_task(build_manual_ann_index)
+        return result
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+AIRFLOW_DAG_ID = os.getenv("AIRFLOW_DAG_ID_Raw", "dag_rag_pipeline_triggered")
+AIRFLOW_BASE_URL = "http://airflow-webserver:8080/api/v1"
+AIRFLOW_USERNAME = os.getenv("AIRFLOW_USERNAME", "airflow")
+AIRFLOW_PASSWORD = os.getenv("AIRFLOW_PASSWORD", "airflow")
 
-@app.post("/generate_summary_manual")
-def generate_summary_manual(payload: dict):
+# ----------------------- DAG STATUS -----------------------
+# One background poller per active dag_run_id, shared by every client waiting
+# on that run, so N watchers cost one Airflow poll. The poll interval starts at
+# DAG_POLL_INTERVAL, backs off while the state is unchanged or Airflow errors,
+# and resets on every state change. Watchers long-poll /dag_status with the
+# last version they saw and are woken as soon as the state changes. Finished
+# runs are kept for DAG_WATCH_RETENTION seconds so late watchers still get
+# the final state.
+DAG_POLL_INTERVAL = float(os.getenv("DAG_POLL_INTERVAL", 2))
+DAG_POLL_MAX_INTERVAL = float(os.getenv("DAG_POLL_MAX_INTERVAL", 15))
+DAG_POLL_MAX_ERRORS = int(os.getenv("DAG_POLL_MAX_ERRORS", 5))
+DAG_WATCH_TIMEOUT = float(os.getenv("DAG_WATCH_TIMEOUT", 1800))
+DAG_WATCH_RETENTION = float(os.getenv("DAG_WATCH_RETENTION", 300))
+DAG_TERMINAL_STATES = ("success", "failed", "error", "timeout")
+
+class DagRunWatch:
+    def __init__(self, dag_run_id):
+        self.dag_run_id = dag_run_id
+        self.state = None
+        self.detail = None
+        self.version = 0
+        self.polls = 0
+        self.watchers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.state in DAG_TERMINAL_STATES
+
+    def publish(self, state, detail=None):
+        self.state, self.detail = state, detail
+        self.version += 1
+        # Wake everyone waiting on the previous version
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, version, timeout):
+        """Return once the state moved past `version`, or after `timeout` seconds."""
+        if self.version != version or self.done:
+            return
+        self.watchers += 1
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.watchers -= 1
 
-    year = payload.get("year")
-    quarter = payload.get("quarter")
-    parser = payload.get("parser")
-    strategy = payload.get("strategy")
+    def to_dict(self):
+        return {
+            "dag_run_id": self.dag_run_id,
+            "state": self.state,
+            "detail": self.detail,
+            "version": self.version,
+            "done": self.done,
+            "polls": self.polls,
+            "watchers": self.watchers,
+        }
 
-    if not all([year, quarter, parser, strategy]):
-        raise HTTPException(status_code=400, detail="Missing parameters")
+dag_watches = {}
 
+async def poll_dag_run(watch):
+    url = f"{AIRFLOW_BASE_URL}/dags/{AIRFLOW_DAG_ID}/dagRuns/{watch.dag_run_id}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DAG_WATCH_TIMEOUT
+    delay, errors = DAG_POLL_INTERVAL, 0
     try:
-        print(f"📄 Generating summary using manual RAG")
-        chunks = search_manual_vectors("summary", parser, strategy, year, quarter, top_k=30)
-        context = "\n\n".join(chunks)
-        if len(context) > 15000:
-            context = context[:15000]
-
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a financial analyst. Generate an executive summary from this content."},
-                {"role": "user", "content": context}
-            ]
-        )
-        summary = completion.choices[0].message.content
-        return {"summary": summary, "source_chunks": chunks}
+        while loop.time() < deadline:
+            try:
+                response = await app.state.http.get(url, auth=(AIRFLOW_USERNAME, AIRFLOW_PASSWORD))
+                watch.polls += 1
+                response.raise_for_status()
+                state = response.json().get("state")
+                errors = 0
+            except (httpx.HTTPError, ValueError) as e:
+                errors += 1
+                print(f"⚠️ Airflow poll {errors}/{DAG_POLL_MAX_ERRORS} failed for {watch.dag_run_id}: {e}")
+                if errors >= DAG_POLL_MAX_ERRORS:
+                    watch.publish("error", f"Error contacting Airflow: {e}")
+                    return
+                delay = min(delay * 2, DAG_POLL_MAX_INTERVAL)
+            else:
+                if state != watch.state:
+                    print(f"🛰️ DAG run {watch.dag_run_id}: {state}")
+                    watch.publish(state)
+                    delay = DAG_POLL_INTERVAL
+                else:
+                    delay = min(delay * 1.5, DAG_POLL_MAX_INTERVAL)
+                if watch.done:
+                    return
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+        watch.publish("timeout", "DAG is still running after timeout.")
     except Exception as e:
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-    
-AIRFLOW_DAG_ID = os.getenv("AIRFLOW_DAG_ID_Raw", "dag_rag_pipeline_triggered")
-AIRFLOW_BASE_URL = "http://airflow-webserver:8080/api/v1"
-AIRFLOW_USERNAME = os.getenv("AIRFLOW_USERNAME", "airflow")
-AIRFLOW_PASSWORD = os.getenv("AIRFLOW_PASSWORD", "airflow")
+        watch.publish("error", str(e))
+    finally:
+        # Keep the final state around for late watchers, then forget the run
+        loop.call_later(DAG_WATCH_RETENTION, dag_watches.pop, watch.dag_run_id, None)
+
+def get_dag_watch(dag_run_id):
+    watch = dag_watches.get(dag_run_id)
+    if watch is None:
+        watch = dag_watches[dag_run_id] = DagRunWatch(dag_run_id)
+        watch.task = asyncio.create_task(poll_dag_run(watch))
+    return watch
+
+@app.get("/dag_status/{dag_run_id}")
+async def dag_status(dag_run_id: str, version: int = -1, timeout: float = 25):
+    """
+    Long-poll: return the run's state as soon as it differs from `version`
+    (a new watcher waits for the first poll), or the unchanged state after
+    `timeout`.
+    """
+    watch = get_dag_watch(dag_run_id)
+    await watch.wait(max(version, 0), min(timeout, 60))
+    return watch.to_dict()
+
+@app.get("/dag_watch_stats")
+async def dag_watch_stats():
+    return {"active": sum(not w.done for w in dag_watches.values()),
+            "runs": [watch.to_dict() for watch in dag_watches.values()]}
 
 @app.get("/check_dag_status/{dag_run_id}")
 async def check_dag_status(dag_run_id: str):
     """
-    Poll the DAG run status from Airflow until it finishes or times out.
+    Wait (on the shared poller) until the DAG run finishes or times out.
     """
     if not dag_run_id:
         raise HTTPException(status_code=400, detail="dag_run_id is required.")
 
-    url = f"{AIRFLOW_BASE_URL}/dags/{AIRFLOW_DAG_ID}/dagRuns/{dag_run_id}"
-
-    max_retries = 50  # Retry for 1 minute (12 * 5s)
-    retries = 0
-
-    while retries < max_retries:
-        try:
-            response = requests.get(url, auth=(AIRFLOW_USERNAME, AIRFLOW_PASSWORD))
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error contacting Airflow: {str(e)}")
-
-        if response.status_code == 200:
-            state = response.json().get("state")
-            if state in ["success", "failed"]:
-                return {"status": state}
-        else:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch DAG status")
-
-        retries += 1
-        await asyncio.sleep(5)
-
-    raise HTTPException(status_code=408, detail="DAG is still running after timeout.")
\ No newline at end of file
+    watch = get_dag_watch(dag_run_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + 250
+    while not watch.done and loop.time() < deadline:
+        await watch.wait(watch.version, deadline - loop.time())
+
+    if watch.state in ["success", "failed"]:
+        return {"status": watch.state}
+    if watch.state == "error":
+        raise HTTPException(status_code=502, detail=watch.detail)
+    raise HTTPException(status_code=408, detail="DAG is still running after timeout.")
@@ -0,0 +1,122 @@
+import os
+import gzip
+import json
+import hashlib
+import boto3
+from dotenv import load_dotenv
+
+from chunking.chunks import iter_chunks, STRATEGY_LIMITS
+
+# Chunk artifacts live next to the markdown they were cut from:
+#   {parser}_markdown/{year}/{quarter}/chunks/{markdown sha256}/{strategy}-{params hash}.json.gz
+# Chunk text is re-sliced from the (identical) markdown and only stored for
+# the chunks where a splitter rewrote it (joined sentences, dropped separator
+# whitespace, decoded token windows), so artifacts stay small.
+
+load_dotenv()
+AWS_BUCKET = os.getenv("AWS_BUCKET_NAME")
+
+s3_client = boto3.client(
+    "s3",
+    region_name=os.getenv("AWS_REGION"),
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+)
+
+# Bump when iter_chunks changes how it cuts chunks, to invalidate old artifacts.
+CHUNK_ARTIFACT_VERSION = 2
+
+def markdown_hash(markdown):
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+def chunk_params(strategy, max_tokens=None, overlap=0):
+    if strategy not in STRATEGY_LIMITS:
+        raise ValueError("❌ Invalid chunking strategy.")
+    return {
+        "strategy": strategy,
+        "max_tokens": max_tokens or STRATEGY_LIMITS[strategy],
+        "overlap": overlap,
+        "version": CHUNK_ARTIFACT_VERSION,
+    }
+
+def artifact_key(markdown, year, quarter, parser, params):
+    params_hash = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{parser}_markdown/{year}/{quarter}/chunks/{markdown_hash(markdown)}/{params['strategy']}-{params_hash}.json.gz"
+
+def load_chunk_artifact(key, markdown):
+    try:
+        response = s3_client.get_object(Bucket=AWS_BUCKET, Key=key)
+        artifact = json.loads(gzip.decompress(response["Body"].read()))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    except Exception as e:
+        print(f"⚠️ Could not read chunk artifact {key}, re-chunking: {e}")
+        return None
+
+    if artifact.get("markdown_sha256") != markdown_hash(markdown):
+        return None
+
+    return [
+        {
+            "index": i,
+            "text": span[4] if len(span) > 4 else markdown[span[2]:span[3]],
+            "token_start": span[0],
+            "token_end": span[1],
+            "char_start": span[2],
+            "char_end": span[3],
+        }
+        for i, span in enumerate(artifact["spans"])
+    ]
+
+def _artifact_span(markdown, record):
+    span = [record["token_start"], record["token_end"], record["char_start"], record["char_end"]]
+    if record["text"] != markdown[record["char_start"]:record["char_end"]]:
+        span.append(record["text"])
+    return span
+
+def save_chunk_artifact(key, markdown, params, records):
+    artifact = {
+        "markdown_sha256": markdown_hash(markdown),
+        "params": params,
+        "spans": [_artifact_span(markdown, r) for r in records],
+    }
+    body = gzip.compress(json.dumps(artifact, separators=(",", ":")).encode("utf-8"))
+    s3_client.put_object(Bucket=AWS_BUCKET, Key=key, Body=body, ContentType="application/json", ContentEncoding="gzip")
+    print(f"💾 Saved {len(records)} chunk spans to s3://{AWS_BUCKET}/{key} ({len(body)} bytes)")
+
+def ensure_chunk_artifact(markdown, year, quarter, parser, strategy, max_tokens=None, overlap=0):
+    """
+    Return (key, records, cached), chunking and persisting the artifact only
+    if it does not exist yet.
+    """
+    params = chunk_params(strategy, max_tokens, overlap)
+    key = artifact_key(markdown, year, quarter, parser, params)
+
+    records = load_chunk_artifact(key, markdown)
+    if records is not None:
+        return key, records, True
+
+    records = list(iter_chunks(markdown, strategy, params["max_tokens"], overlap))
+    save_chunk_artifact(key, markdown, params, records)
+    return key, records, False
+
+def _chunk_and_save(markdown, key, params):
+    records = []
+    for record in iter_chunks(markdown, params["strategy"], params["max_tokens"], params["overlap"]):
+        records.append(record)
+        yield record
+    save_chunk_artifact(key, markdown, params, records)
+
+def chunk_records(markdown, year, quarter, parser, strategy, max_tokens=None, overlap=0):
+    """
+    Chunk records for the upload paths: served from the stored artifact when
+    present, otherwise streamed from iter_chunks and persisted once consumed.
+    """
+    params = chunk_params(strategy, max_tokens, overlap)
+    key = artifact_key(markdown, year, quarter, parser, params)
+
+    records = load_chunk_artifact(key, markdown)
+    if records is not None:
+        print(f"♻️ Reusing {len(records)} chunks from s3://{AWS_BUCKET}/{key}")
+        return iter(records)
+    return _chunk_and_save(markdown, key, params)
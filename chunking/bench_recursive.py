@@ -0,0 +1,86 @@
+import argparse
+import os
+import random
+import time
+
+from chunking.chunks import CHUNK_LIMIT, break_into_subchunks, iter_chunks, recursive_split, token_count
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Q1 (1).md")
+
+# Previous implementation, kept only as the baseline for timing and output comparison.
+def legacy_recursive_split(text, max_tokens=CHUNK_LIMIT):
+    if token_count(text) <= max_tokens:
+        return [text]
+
+    for splitter in ["\n\n", "\n", ". "]:
+        parts = text.split(splitter)
+        if len(parts) == 1:
+            continue
+
+        chunks, current = [], ""
+        for part in parts:
+            candidate = (current + splitter + part).strip() if current else part.strip()
+            if token_count(candidate) <= max_tokens:
+                current = candidate
+            else:
+                if current:
+                    chunks.extend(legacy_recursive_split(current, max_tokens))
+                current = part.strip()
+        if current:
+            chunks.extend(legacy_recursive_split(current, max_tokens))
+        return chunks
+
+    return break_into_subchunks(text, max_tokens=max_tokens)
+
+# Text around the separators where token merges are hardest to predict: runs
+# of punctuation and whitespace on either side of "\n\n", "\n" and ". ".
+HARD_JOIN_PIECES = [
+    "revenue", "Q1", "12345", "'s", "---", "|", "| --- |", "...", "!!", ".", "..",
+    " ", "  ", "\t", " \n", "\n", "\n\n", "\n\n\n", ". ", ". .", " . ", "\n .\n", "==\n\n==",
+]
+
+def check_hard_joins(cases, seed=0):
+    rng = random.Random(seed)
+    for case in range(cases):
+        text = "".join(rng.choice(HARD_JOIN_PIECES) for _ in range(rng.randint(20, 400)))
+        for max_tokens in (2, 5, 16, 64):
+            if recursive_split(text, max_tokens) != legacy_recursive_split(text, max_tokens):
+                raise SystemExit(f"❌ Hard-join case {case} differs at max_tokens={max_tokens}: {text!r}")
+    print(f"✅ {cases} hard-join cases match the legacy chunks")
+
+def best_of(fn, text, max_tokens, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text, max_tokens)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recursive_split against the legacy implementation.")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="Path to Markdown input file.")
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[CHUNK_LIMIT, 2000, 500], help="Chunk limits to test.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per implementation (best time is reported).")
+    parser.add_argument("--join-cases", type=int, default=500, help="Random hard-join texts compared against the legacy chunks.")
+    args = parser.parse_args()
+
+    check_hard_joins(args.join_cases)
+
+    with open(args.input, "r", encoding="utf-8") as file:
+        markdown_data = file.read()
+
+    print(f"📄 {args.input}: {len(markdown_data)} chars, {token_count(markdown_data)} tokens")
+    for max_tokens in args.max_tokens:
+        legacy_time, legacy_chunks = best_of(legacy_recursive_split, markdown_data, max_tokens, args.repeat)
+        new_time, new_chunks = best_of(recursive_split, markdown_data, max_tokens, args.repeat)
+
+        if new_chunks != legacy_chunks:
+            raise SystemExit(f"❌ Chunk boundaries differ at max_tokens={max_tokens}")
+        if [record["text"] for record in iter_chunks(markdown_data, "recursive", max_tokens)] != legacy_chunks:
+            raise SystemExit(f"❌ iter_chunks differs from the legacy chunks at max_tokens={max_tokens}")
+
+        print(
+            f"🔹 max_tokens={max_tokens}: {len(new_chunks)} chunks | "
+            f"legacy {legacy_time * 1000:.1f} ms | new {new_time * 1000:.1f} ms | "
+            f"speedup {legacy_time / new_time:.1f}x"
+        )
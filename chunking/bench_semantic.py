@@ -0,0 +1,60 @@
+import argparse
+import os
+import time
+
+from chunking.chunks import (
+    SEMANTIC_BLOCK_MEMORY_MB, SPACY_BYTES_PER_CHAR,
+    _sentence_blocks, iter_sentence_spans, load_sentence_nlp,
+)
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Q1 (1).md")
+
+# Previous approach, kept only as the baseline: the whole document in one nlp() call.
+def single_call_spans(md_text, segmenter):
+    nlp = load_sentence_nlp(segmenter)
+    nlp.max_length = max(nlp.max_length, len(md_text) + 1)
+    return [(sent.start_char, sent.end_char) for sent in nlp(md_text).sents]
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def describe(md_text, position, cuts, width=40):
+    near = min((abs(position - cut) for cut in cuts), default=None)
+    context = md_text[max(0, position - width):position] + "⏐" + md_text[position:position + width]
+    return f"@{position} ({near} chars from a block cut): {context!r}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare block-wise sentence segmentation against a single nlp() call.")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="Path to Markdown input file.")
+    parser.add_argument("--segmenter", choices=["parser", "sentencizer"], default="parser")
+    parser.add_argument("--block-memory-mb", type=int, nargs="+", default=[SEMANTIC_BLOCK_MEMORY_MB, 64, 8], help="Block ceilings to test.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes for the block-wise run.")
+    parser.add_argument("--show", type=int, default=5, help="Differing boundaries to print per ceiling.")
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as file:
+        markdown_data = file.read()
+
+    print(f"📄 {args.input}: {len(markdown_data)} chars, segmenter={args.segmenter}")
+    single_time, single = timed(single_call_spans, markdown_data, args.segmenter)
+    single_starts = {start for start, _ in single}
+    print(f"🔹 single call: {len(single)} sentences in {single_time * 1000:.1f} ms")
+
+    for memory_mb in args.block_memory_mb:
+        max_chars = max(1, memory_mb * 1024 * 1024 // SPACY_BYTES_PER_CHAR)
+        cuts = [start for start, _ in _sentence_blocks(markdown_data, max_chars)][1:]
+        block_time, spans = timed(
+            lambda: list(iter_sentence_spans(markdown_data, args.segmenter, args.processes, memory_mb))
+        )
+        starts = {start for start, _ in spans}
+        added, missing = sorted(starts - single_starts), sorted(single_starts - starts)
+
+        print(
+            f"🔹 block_memory_mb={memory_mb}: {len(cuts) + 1} blocks | {len(spans)} sentences in "
+            f"{block_time * 1000:.1f} ms | {len(added)} boundaries added, {len(missing)} missing"
+        )
+        for label, positions in (("+", added), ("-", missing)):
+            for position in positions[:args.show]:
+                print(f"   {label} {describe(markdown_data, position, cuts)}")
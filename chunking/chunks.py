@@ -1,83 +1,340 @@
 import re
 import os
+import regex
 import spacy
 import tiktoken
 import argparse
 import json
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 
-# Setup NLP model and tokenizer
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    from spacy.cli import download
-    download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
-
+# Setup tokenizer (spaCy pipelines are loaded lazily, see load_sentence_nlp)
 tokenizer = tiktoken.encoding_for_model("text-embedding-3-small")
 
 # Constants
 CHUNK_LIMIT = 8192
 SAFE_LIMIT = 2000
 
+# Sentence segmentation only needs tok2vec + parser from en_core_web_sm; the
+# other components are never loaded.
+SPACY_MODEL = "en_core_web_sm"
+SENTENCE_EXCLUDE = ["tagger", "attribute_ruler", "lemmatizer", "ner", "senter"]
+# spaCy's parser needs on the order of 10 KB of working memory per input
+# character, so each segmented block is capped to fit SEMANTIC_BLOCK_MEMORY_MB.
+SPACY_BYTES_PER_CHAR = 10_000
+SEMANTIC_BLOCK_MEMORY_MB = int(os.getenv("SEMANTIC_BLOCK_MEMORY_MB", 512))
+SEMANTIC_PROCESSES = int(os.getenv("SEMANTIC_PROCESSES", min(4, os.cpu_count() or 1)))
+
 def token_count(text):
     return len(tokenizer.encode(text))
 
-def break_into_subchunks(text, max_tokens=SAFE_LIMIT):
+# The splitters below are generators of (chunk, char_start, char_end), where
+# char_start/char_end locate the chunk in the text they were given; the list
+# functions (heading_based_split, semantic_split, recursive_split) and
+# iter_chunks all consume them, so both APIs produce the same chunks.
+
+def _token_windows(text, offset, max_tokens):
+    # break_into_subchunks; offset is text's position in the document
     tokens = tokenizer.encode(text)
     if len(tokens) <= max_tokens:
-        return [text]
-    return [tokenizer.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+        yield text, offset, offset + len(text)
+        return
+    _, starts = tokenizer.decode_with_offsets(tokens)
+    starts.append(len(text))
+    for i in range(0, len(tokens), max_tokens):
+        end = min(i + max_tokens, len(tokens))
+        yield tokenizer.decode(tokens[i:end]), offset + starts[i], offset + starts[end]
 
-def heading_based_split(md_text, level=2):
-    header_pattern = rf'(?=^{"#" * level} )'
-    raw_segments = re.split(header_pattern, md_text, flags=re.MULTILINE)
-    
-    final_chunks = []
-    for section in raw_segments:
+def break_into_subchunks(text, max_tokens=SAFE_LIMIT):
+    return [chunk for chunk, _, _ in _token_windows(text, 0, max_tokens)]
+
+def _heading_chunks(md_text, level=2, max_tokens=CHUNK_LIMIT // 2):
+    cuts = [m.start() for m in re.finditer(rf'^{"#" * level} ', md_text, flags=re.MULTILINE)]
+    bounds = [0] + cuts + [len(md_text)]
+    for start, end in zip(bounds, bounds[1:]):
+        section = md_text[start:end]
         cleaned = section.strip()
         if cleaned:
-            final_chunks.extend(break_into_subchunks(cleaned, max_tokens=CHUNK_LIMIT // 2))
-    return final_chunks
-
-def semantic_split(md_text, max_sents=5):
-    doc = nlp(md_text)
-    sents = [sent.text for sent in doc.sents]
-
-    grouped = []
-    buffer = []
-    for idx, sentence in enumerate(sents):
-        buffer.append(sentence)
-        if (idx + 1) % max_sents == 0:
-            joined = " ".join(buffer)
-            grouped.extend(break_into_subchunks(joined, max_tokens=CHUNK_LIMIT // 2))
-            buffer = []
-    if buffer:
-        grouped.extend(break_into_subchunks(" ".join(buffer), max_tokens=CHUNK_LIMIT // 2))
-    return grouped
+            yield from _token_windows(cleaned, start + len(section) - len(section.lstrip()), max_tokens)
 
-def recursive_split(text, max_tokens=CHUNK_LIMIT):
-    if token_count(text) <= max_tokens:
-        return [text]
+def heading_based_split(md_text, level=2):
+    return [chunk for chunk, _, _ in _heading_chunks(md_text, level)]
+
+_sentence_nlp = {}
+
+def load_sentence_nlp(segmenter="parser"):
+    """
+    "parser" keeps the dependency-parse sentence boundaries used so far;
+    "sentencizer" is a rule-based, model-free alternative that is much faster.
+    """
+    if segmenter not in _sentence_nlp:
+        if segmenter == "parser":
+            try:
+                nlp = spacy.load(SPACY_MODEL, exclude=SENTENCE_EXCLUDE)
+            except OSError:
+                from spacy.cli import download
+                download(SPACY_MODEL)
+                nlp = spacy.load(SPACY_MODEL, exclude=SENTENCE_EXCLUDE)
+        elif segmenter == "sentencizer":
+            nlp = spacy.blank("en")
+            nlp.add_pipe("sentencizer")
+        else:
+            raise ValueError(f"Unknown sentence segmenter: {segmenter}")
+        _sentence_nlp[segmenter] = nlp
+    return _sentence_nlp[segmenter]
+
+def _sentence_blocks(md_text, max_chars):
+    # Cut after paragraph breaks where possible; a single paragraph over the
+    # ceiling is cut at its last newline or space instead.
+    blocks, start, last_break = [], 0, 0
+    breaks = [m.end() for m in re.finditer(r"\n\s*\n", md_text)] + [len(md_text)]
+    for brk in breaks:
+        if brk - start > max_chars and last_break > start:
+            blocks.append((start, last_break))
+            start = last_break
+        while brk - start > max_chars:
+            limit = start + max_chars
+            cut = max(md_text.rfind("\n", start, limit), md_text.rfind(" ", start, limit)) + 1
+            cut = cut if cut > start else limit
+            blocks.append((start, cut))
+            start = cut
+        last_break = brk
+    if start < len(md_text):
+        blocks.append((start, len(md_text)))
+    return blocks
+
+def _segment_text(segmenter, text):
+    nlp = load_sentence_nlp(segmenter)
+    nlp.max_length = max(nlp.max_length, len(text) + 1)
+    return [(sent.start_char, sent.end_char) for sent in nlp(text).sents]
+
+_sentence_pools = {}
+
+def _sentence_pool(segmenter, n_process):
+    # Started once and reused; workers load the pipeline on their first block.
+    # Spawned rather than forked, since callers may be threaded.
+    key = (segmenter, n_process)
+    if key not in _sentence_pools:
+        _sentence_pools[key] = ProcessPoolExecutor(max_workers=n_process, mp_context=multiprocessing.get_context("spawn"))
+    return _sentence_pools[key]
+
+def iter_sentence_spans(md_text, segmenter="parser", n_process=None, block_memory_mb=None):
+    """
+    Yield (start_char, end_char) for each sentence in md_text.
+
+    The text is cut into blocks under a per-block memory ceiling; several
+    blocks are segmented on a reused pool of n_process worker processes, a
+    single block in-process. Each cut is then re-segmented in a window from
+    the start of the last sentence before it to the start of the second
+    sentence after it (spanning further blocks that hold a single sentence),
+    so a cut adds no boundary the segmenter would not emit. With the
+    sentencizer the result matches a single nlp(md_text) call; with the
+    parser, tok2vec context at a window's edges differs, so boundaries next
+    to a cut can still move. A cut is kept as is when its window would be
+    over the ceiling.
+    chunking/bench_semantic.py lists the differences for a document.
+    """
+    memory_mb = block_memory_mb or SEMANTIC_BLOCK_MEMORY_MB
+    max_chars = max(1, memory_mb * 1024 * 1024 // SPACY_BYTES_PER_CHAR)
+
+    blocks = _sentence_blocks(md_text, max_chars)
+    texts = [md_text[start:end] for start, end in blocks]
+    n_process = max(1, min(n_process or SEMANTIC_PROCESSES, len(blocks)))
+    if n_process > 1:
+        results = _sentence_pool(segmenter, n_process).map(_segment_text, [segmenter] * len(texts), texts)
+    else:
+        results = (_segment_text(segmenter, text) for text in texts)
+
+    # `pending` holds the sentences since the last boundary before a cut
+    pending = []
+    for (offset, _), spans in zip(blocks, results):
+        spans = [(offset + start, offset + end) for start, end in spans]
+        if not spans:
+            continue
+        if pending and len(spans) == 1 and spans[0][1] - pending[0][0] <= max_chars:
+            # One sentence across the whole block: widen the window to the next cut
+            pending += spans
+            continue
+        if pending and len(spans) > 1 and spans[1][0] - pending[0][0] <= max_chars:
+            window = pending[0][0]
+            pending = [(window + start, window + end) for start, end in _segment_text(segmenter, md_text[window:spans[1][0]])]
+            spans = spans[1:]
+        yield from pending
+        yield from spans[:-1]
+        pending = spans[-1:]
+    yield from pending
+
+def _joined_windows(md_text, spans, max_tokens):
+    # A group of sentences joined with single spaces and cut into token
+    # windows; window offsets in the joined text are mapped back to md_text.
+    joined = " ".join(md_text[start:end] for start, end in spans)
+    positions, pos = [], 0
+    for start, end in spans:
+        positions.append(pos)
+        pos += end - start + 1
+
+    def source(offset):
+        k = bisect_right(positions, offset) - 1
+        return min(spans[k][0] + offset - positions[k], spans[k][1])
 
-    for splitter in ["\n\n", "\n", ". "]:
+    for chunk, start, end in _token_windows(joined, 0, max_tokens):
+        yield chunk, source(start), source(end)
+
+def _semantic_chunks(md_text, max_sents=5, max_tokens=CHUNK_LIMIT // 2, segmenter="parser", n_process=None, block_memory_mb=None):
+    group = []
+    for span in iter_sentence_spans(md_text, segmenter, n_process, block_memory_mb):
+        group.append(span)
+        if len(group) == max_sents:
+            yield from _joined_windows(md_text, group, max_tokens)
+            group = []
+    if group:
+        yield from _joined_windows(md_text, group, max_tokens)
+
+def semantic_split(md_text, max_sents=5, segmenter="parser", n_process=None, block_memory_mb=None):
+    chunks = _semantic_chunks(md_text, max_sents, CHUNK_LIMIT // 2, segmenter, n_process, block_memory_mb)
+    return [chunk for chunk, _, _ in chunks]
+
+RECURSIVE_SEPARATORS = ["\n\n", "\n", ". "]
+
+# tiktoken cuts text into pieces with this pattern and encodes every piece on
+# its own. The pattern has no lookbehind, so the pieces from any piece boundary
+# on depend only on the text after it. A chunk never ends in whitespace and
+# every separator starts with "\n" or ".", which no piece can absorb except
+# the chunk's last one; appending therefore only re-cuts that last piece and
+#   count(current + added) == count(current) - count(last) + count(last + added)
+# is exact, not an estimate.
+_PIECES = regex.compile(tokenizer._pat_str)
+
+def _append_count(last, added):
+    # Token count of last + added, with the final piece of that text and its count.
+    text = last + added
+    final = ""
+    for match in _PIECES.finditer(text):
+        final = match.group()
+    return len(tokenizer.encode(text)), final, len(tokenizer.encode(final))
+
+def _recursive_chunks(text, offset, max_tokens, n_tokens):
+    if n_tokens <= max_tokens:
+        yield text, offset, offset + len(text)
+        return
+
+    for splitter in RECURSIVE_SEPARATORS:
         parts = text.split(splitter)
         if len(parts) == 1:
             continue
 
-        chunks, current = [], ""
+        sep_tail = splitter.rstrip()
+        frags, cur_tokens, last, last_tokens = [], 0, "", 0
+        start = end = pos = 0
+
+        def flush():
+            current = "".join(frags)
+            if cur_tokens <= max_tokens:
+                return [(current, offset + start, offset + end)]
+            # Only a lone part can be over the limit, and it is a slice of text
+            return _recursive_chunks(current, offset + start, max_tokens, cur_tokens)
+
         for part in parts:
-            candidate = (current + splitter + part).strip() if current else part.strip()
-            if token_count(candidate) <= max_tokens:
-                current = candidate
+            tail = part.rstrip()
+            stripped = tail.lstrip()
+
+            if frags:
+                # Same text as (current + splitter + part).strip() in the
+                # original implementation, without rebuilding the buffer.
+                added = splitter + tail if tail else sep_tail
+                tokens, new_last, new_last_tokens = _append_count(last, added)
+                tokens += cur_tokens - last_tokens
+                if tokens <= max_tokens:
+                    frags.append(added)
+                    cur_tokens, last, last_tokens = tokens, new_last, new_last_tokens
+                    end = pos + len(tail) if tail else pos - len(splitter) + len(sep_tail)
+                    pos += len(part) + len(splitter)
+                    continue
+                yield from flush()
+
+            if stripped:
+                frags = [stripped]
+                cur_tokens, last, last_tokens = _append_count("", stripped)
+                start = pos + len(part) - len(part.lstrip())
+                end = start + len(stripped)
             else:
-                if current:
-                    chunks.extend(recursive_split(current, max_tokens))
-                current = part.strip()
-        if current:
-            chunks.extend(recursive_split(current, max_tokens))
-        return chunks
+                frags = []
+            pos += len(part) + len(splitter)
+
+        if frags:
+            yield from flush()
+        return
+
+    yield from _token_windows(text, offset, max_tokens)
+
+def recursive_split(text, max_tokens=CHUNK_LIMIT):
+    return [chunk for chunk, _, _ in _recursive_chunks(text, 0, max_tokens, token_count(text))]
+
+# ---------- Streaming chunk records ----------
+# iter_chunks yields the splitters' chunks lazily as dicts:
+#   {"index", "text", "token_start", "token_end", "char_start", "char_end"}
+# Token offsets index one encoding of the whole document. "text" is
+# md_text[char_start:char_end] except where a splitter rewrote whitespace
+# (the single-space sentence join, a dropped separator) or cut a token window.
+
+STRATEGY_LIMITS = {
+    "heading": CHUNK_LIMIT // 2,
+    "semantic": CHUNK_LIMIT // 2,
+    "recursive": CHUNK_LIMIT,
+}
+
+def _records(md_text, chunks, token_starts, overlap):
+    for index, (text, char_start, char_end) in enumerate(chunks):
+        token_start = bisect_left(token_starts, char_start)
+        token_end = bisect_left(token_starts, char_end)
+        if overlap and token_start:
+            lo = max(0, token_start - overlap)
+            text = md_text[token_starts[lo]:char_start] + text
+            token_start, char_start = lo, token_starts[lo]
+        yield {
+            "index": index,
+            "text": text,
+            "token_start": token_start,
+            "token_end": token_end,
+            "char_start": char_start,
+            "char_end": char_end,
+        }
+
+def iter_chunks(md_text, strategy="recursive", max_tokens=None, overlap=0):
+    """
+    Lazily yield chunk records for md_text.
+
+    Chunks are cut to at most max_tokens tokens (the strategy's usual limit
+    by default), so with no overlap the texts are exactly those of
+    heading_based_split, semantic_split and recursive_split. With overlap > 0,
+    chunks are cut to max_tokens - overlap and each one also repeats the last
+    `overlap` tokens of the document before it.
+    """
+    if strategy not in STRATEGY_LIMITS:
+        raise ValueError("❌ Invalid chunking strategy.")
+    max_tokens = max_tokens or STRATEGY_LIMITS[strategy]
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be between 0 and max_tokens - 1.")
+
+    tokens = tokenizer.encode(md_text)
+    _, token_starts = tokenizer.decode_with_offsets(tokens)
+    token_starts.append(len(md_text))
+    step = max_tokens - overlap
+
+    if strategy == "heading":
+        chunks = _heading_chunks(md_text, max_tokens=step)
+    elif strategy == "semantic":
+        chunks = _semantic_chunks(md_text, max_tokens=step)
+    else:
+        chunks = _recursive_chunks(md_text, 0, step, len(tokens))
+    return _records(md_text, chunks, token_starts, overlap)
 
-    return break_into_subchunks(text, max_tokens=max_tokens)
+def batch_records(records, size):
+    iterator = iter(records)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Choose a chunking strategy.")
@@ -85,6 +342,8 @@ if __name__ == "__main__":
     parser.add_argument("--input", default="chunks/Q1 (1).md", help="Path to Markdown input file.")
     parser.add_argument("--preview", action="store_true", help="Print chunks to console.")
     parser.add_argument("--save", action="store_true", help="Save chunks to .txt and .json")
+    parser.add_argument("--segmenter", choices=["parser", "sentencizer"], default="parser", help="Sentence segmenter for the semantic strategy.")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes for the semantic strategy.")
 
     args = parser.parse_args()
     strategy = args.strategy
@@ -102,7 +361,7 @@ if __name__ == "__main__":
     if strategy == "heading":
         chunks = heading_based_split(markdown_data)
     elif strategy == "semantic":
-        chunks = semantic_split(markdown_data)
+        chunks = semantic_split(markdown_data, segmenter=args.segmenter, n_process=args.processes)
     elif strategy == "recursive":
         chunks = recursive_split(markdown_data)
     else:
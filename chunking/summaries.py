@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import threading
+import openai
+import boto3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from chunking.chunks import iter_chunks, token_count
+from chunking.artifacts import markdown_hash
+from embedding.index_cache import ShardCache
+
+# Precomputed document summaries, built once per markdown version as an
+# ingestion stage:
+#   map    - each heading section (packed to SECTION_TOKENS) is summarized,
+#            SUMMARY_CONCURRENCY requests at a time
+#   reduce - section summaries are merged (in rounds if they exceed
+#            REDUCE_TOKENS) into one executive summary
+# Results live next to the markdown:
+#   {parser}_markdown/{year}/{quarter}/summaries/{markdown sha256}.json
+#   {parser}_markdown/{year}/{quarter}/summaries/latest.json  (pointer with the markdown ETag)
+# so the summary endpoints can check freshness with a HEAD request instead of
+# downloading and hashing the markdown. The pointer and the markdown ETag are
+# kept in-process for SUMMARY_POINTER_TTL seconds, then revalidated with HEAD
+# requests on both objects.
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+AWS_BUCKET = os.getenv("AWS_BUCKET_NAME")
+
+s3_client = boto3.client(
+    "s3",
+    region_name=os.getenv("AWS_REGION"),
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+)
+
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", 8))
+SECTION_TOKENS = int(os.getenv("SUMMARY_SECTION_TOKENS", 6000))
+REDUCE_TOKENS = int(os.getenv("SUMMARY_REDUCE_TOKENS", 12000))
+SUMMARY_VERSION = 1
+SUMMARY_POINTER_TTL = float(os.getenv("SUMMARY_POINTER_TTL_SECONDS", 30))
+# Stored summaries kept in-process, least recently used evicted first
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 64))
+
+MAP_PROMPT = "Summarize this section of a financial report. Keep every figure, period and segment name that matters."
+REDUCE_PROMPT = "Combine these section summaries of a financial report into one summary, keeping the key figures."
+EXECUTIVE_PROMPT = "You are a professional financial analyst. Write a detailed executive summary of the report from these section summaries."
+
+_summary_cache = OrderedDict()
+_summary_cache_lock = threading.Lock()
+_pointer_cache = ShardCache(revalidate_after=SUMMARY_POINTER_TTL)
+
+def markdown_key(year, quarter, parser):
+    return f"{parser}_markdown/{year}/{quarter}/{quarter}.md"
+
+def summary_prefix(year, quarter, parser):
+    return f"{parser}_markdown/{year}/{quarter}/summaries"
+
+def _complete(system, content):
+    completion = openai.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": content}
+        ]
+    )
+    return completion.choices[0].message.content
+
+def _summarize_all(system, texts):
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        return list(pool.map(lambda text: _complete(system, text), texts))
+
+def _group(texts, max_tokens):
+    groups, current, used = [], [], 0
+    for text in texts:
+        tokens = token_count(text)
+        if current and used + tokens > max_tokens:
+            groups.append("\n\n".join(current))
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+def map_reduce_summary(markdown):
+    """Return (executive_summary, section_summaries) for a markdown document."""
+    # Heading sections, packed together up to SECTION_TOKENS per map request
+    sections = _group([record["text"] for record in iter_chunks(markdown, "heading", SECTION_TOKENS)], SECTION_TOKENS)
+    start = time.perf_counter()
+    section_summaries = _summarize_all(MAP_PROMPT, sections)
+    print(f"🗺️ Summarized {len(sections)} sections in {time.perf_counter() - start:.1f}s")
+
+    summaries = section_summaries
+    while len(summaries) > 1 and sum(token_count(s) for s in summaries) > REDUCE_TOKENS:
+        groups = _group(summaries, REDUCE_TOKENS)
+        if len(groups) == len(summaries):
+            # Summaries too long to pair up; let the final step take them all
+            break
+        summaries = _summarize_all(REDUCE_PROMPT, groups)
+        print(f"🔁 Reduced to {len(summaries)} summaries")
+
+    executive_summary = _complete(EXECUTIVE_PROMPT, "\n\n".join(summaries))
+    return executive_summary, section_summaries
+
+def _get_json(key):
+    try:
+        response = s3_client.get_object(Bucket=AWS_BUCKET, Key=key)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read())
+
+def _put_json(key, value):
+    s3_client.put_object(Bucket=AWS_BUCKET, Key=key, Body=json.dumps(value), ContentType="application/json")
+
+def ensure_document_summary(year, quarter, parser):
+    """
+    Ingestion stage: build and store the summary for the current markdown,
+    unless one already exists for its hash. Returns the stored summary.
+    """
+    response = s3_client.get_object(Bucket=AWS_BUCKET, Key=markdown_key(year, quarter, parser))
+    markdown = response["Body"].read().decode("utf-8")
+    sha = markdown_hash(markdown)
+    prefix = summary_prefix(year, quarter, parser)
+    key = f"{prefix}/{sha}.json"
+
+    summary = _get_json(key)
+    if summary is None or summary.get("version") != SUMMARY_VERSION:
+        executive_summary, section_summaries = map_reduce_summary(markdown)
+        summary = {
+            "version": SUMMARY_VERSION,
+            "markdown_sha256": sha,
+            "model": SUMMARY_MODEL,
+            "summary": executive_summary,
+            "section_summaries": section_summaries,
+            "created": time.time(),
+        }
+        _put_json(key, summary)
+        print(f"💾 Saved document summary to s3://{AWS_BUCKET}/{key}")
+    else:
+        print(f"♻️ Summary for {sha[:12]} already exists")
+
+    _put_json(f"{prefix}/latest.json", {"markdown_etag": response["ETag"], "markdown_sha256": sha, "key": key})
+    _pointer_cache.invalidate(f"{prefix}/latest.json")
+    return summary
+
+def _head_etag(key):
+    try:
+        return s3_client.head_object(Bucket=AWS_BUCKET, Key=key)["ETag"]
+    except Exception:
+        return None
+
+def _summary_pointer(year, quarter, parser):
+    """Return (latest.json pointer, current markdown ETag); either may be None."""
+    pointer_key = f"{summary_prefix(year, quarter, parser)}/latest.json"
+    etags = lambda: (_head_etag(pointer_key), _head_etag(markdown_key(year, quarter, parser)))
+
+    def load():
+        version = etags()
+        pointer = _get_json(pointer_key) if version[0] else None
+        return (pointer, version[1]), version, 0
+
+    return _pointer_cache.get(pointer_key, fetch_etag=etags, load=load)
+
+def load_document_summary(year, quarter, parser):
+    """Return the stored summary if it matches the current markdown, else None."""
+    pointer, etag = _summary_pointer(year, quarter, parser)
+    if pointer is None or etag is None or etag != pointer["markdown_etag"]:
+        return None
+
+    # Summaries are immutable per markdown hash
+    key = pointer["key"]
+    with _summary_cache_lock:
+        if key in _summary_cache:
+            _summary_cache.move_to_end(key)
+            return _summary_cache[key]
+    summary = _get_json(key)
+    if summary is None or summary.get("version") != SUMMARY_VERSION:
+        return None
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
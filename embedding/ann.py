@@ -0,0 +1,139 @@
+import os
+import json
+import gzip
+import numpy as np
+
+# Pure NumPy inverted-file (IVF) approximate nearest neighbour index over
+# L2-normalized float32 vectors (dot product = cosine).
+#
+# Vectors are clustered with spherical k-means into `nlist` lists and stored
+# grouped by list, so every list is one contiguous slice of the matrix. A query
+# scores the centroids, scans only the `nprobe` closest lists and rescores
+# those rows exactly; a higher nprobe gives better recall at higher latency.
+# Metadata filters are applied before scoring, and further lists are probed
+# (closest first) until the filter leaves at least top_k rows. When a filter
+# leaves only a few rows, they are all scored exactly instead.
+
+ANN_NPROBE = int(os.getenv("MANUAL_ANN_NPROBE", 8))
+EXACT_FILTER_ROWS = int(os.getenv("MANUAL_ANN_EXACT_FILTER_ROWS", 2048))
+
+def _assign(vectors, centroids, block=8192):
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], block):
+        labels[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return labels
+
+def _spherical_kmeans(vectors, nlist, iterations, sample, seed):
+    rng = np.random.default_rng(seed)
+    train = vectors[rng.choice(vectors.shape[0], min(sample, vectors.shape[0]), replace=False)]
+    centroids = train[rng.choice(train.shape[0], nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists from random training rows
+        sums[empty] = train[rng.choice(train.shape[0], int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+class IVFIndex:
+    def __init__(self, centroids, offsets, vectors, columns, sources=()):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        self.sources = set(sources)
+
+    @classmethod
+    def build(cls, vectors, columns, nlist=None, iterations=10, sample=50_000, seed=0, sources=()):
+        """
+        vectors: (n, d) L2-normalized float32; columns: {name: list} aligned with rows.
+        `sources` records what the index was built from (e.g. segment ids).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n = vectors.shape[0]
+        nlist = max(1, min(nlist or int(4 * np.sqrt(n)), n))
+
+        centroids = _spherical_kmeans(vectors, nlist, iterations, sample, seed) if n else np.zeros((1, 0), np.float32)
+        labels = _assign(vectors, centroids) if n else np.zeros(0, dtype=np.int64)
+
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=centroids.shape[0]))])
+        columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+        return cls(centroids, offsets, vectors[order], columns, sources)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), self.vectors, allow_pickle=False)
+        np.savez(
+            os.path.join(directory, "ivf.npz"),
+            centroids=self.centroids,
+            offsets=self.offsets,
+            sources=np.asarray(sorted(self.sources), dtype=str),
+        )
+        columns = {name: values.tolist() for name, values in self.columns.items()}
+        with gzip.open(os.path.join(directory, "meta.json.gz"), "wt", encoding="utf-8") as f:
+            json.dump(columns, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r" if mmap else None)
+        with np.load(os.path.join(directory, "ivf.npz"), allow_pickle=False) as ivf:
+            centroids, offsets, sources = ivf["centroids"], ivf["offsets"], ivf["sources"].tolist()
+        with gzip.open(os.path.join(directory, "meta.json.gz"), "rt", encoding="utf-8") as f:
+            columns = json.load(f)
+        return cls(centroids, offsets, vectors, columns, sources)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.centroids.nbytes + sum(c.nbytes for c in self.columns.values())
+
+    def _filter(self, filters):
+        mask = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            match = self.columns[name] == value
+            mask = match if mask is None else mask & match
+        return mask
+
+    def query(self, vector, top_k=5, nprobe=None, **filters):
+        """
+        Return (rows, scores) of the top_k nearest rows, best first. Keyword
+        filters (e.g. year="2023", parser="docling") restrict the rows
+        searched; None means no restriction.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        mask = self._filter(filters)
+
+        if mask is not None and mask.sum() <= EXACT_FILTER_ROWS:
+            rows = np.flatnonzero(mask)
+        else:
+            nprobe = max(1, min(nprobe or ANN_NPROBE, self.centroids.shape[0]))
+            lists = np.argsort(-(self.centroids @ vector))
+            rows = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists[:nprobe]]
+            if mask is not None:
+                rows = [r[mask[r]] for r in rows]
+                found = sum(r.size for r in rows)
+                # Keep probing in centroid order until the filter leaves top_k rows
+                for i in lists[nprobe:]:
+                    if found >= top_k:
+                        break
+                    r = np.arange(self.offsets[i], self.offsets[i + 1])
+                    rows.append(r[mask[r]])
+                    found += rows[-1].size
+            rows = np.concatenate(rows)
+
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+
+        scores = self.vectors[rows] @ vector
+        k = min(top_k, rows.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+import numpy as np
+
+# Semantic answer cache for the query endpoints. Answers are partitioned by
+# (store, parser, strategy, year, quarters, mode); within a partition a new
+# question reuses a stored answer when its embedding is within
+# ANSWER_CACHE_THRESHOLD cosine similarity of a cached question. Each
+# partition keeps its question vectors in one matrix, so a lookup is a single
+# matrix-vector product. Entries expire after ANSWER_CACHE_TTL seconds, each
+# partition keeps at most ANSWER_CACHE_SIZE entries (least recently used are
+# evicted first), and re-ingesting a filing drops its partitions.
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 6 * 3600))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 256))
+
+def answer_key(store, parser, strategy, year, quarters, mode="vector"):
+    return (store, parser, strategy, year, tuple(quarters), mode)
+
+class _Partition:
+    def __init__(self):
+        self.vectors = None
+        self.entries = []
+        self.created = np.empty(0, dtype=np.float64)
+        self.last_used = np.empty(0, dtype=np.float64)
+
+class SemanticAnswerCache:
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_size=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, vector):
+        """Return the cached value for the closest question in partition `key`, or None."""
+        vector = _normalize(vector)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None or not partition.entries:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            scores = partition.vectors @ vector
+            scores[now - partition.created >= self.ttl] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            partition.last_used[best] = now
+            self.hits += 1
+            return {**partition.entries[best], "similarity": round(float(scores[best]), 4)}
+
+    def put(self, key, vector, value):
+        vector = _normalize(vector)
+        with self._lock:
+            partition = self._partitions.setdefault(key, _Partition())
+            now = time.monotonic()
+            keep = np.flatnonzero(now - partition.created < self.ttl)
+            if keep.size >= self.max_size:
+                # Evict the least recently used entries to make room
+                keep = keep[np.argsort(partition.last_used[keep])[keep.size - self.max_size + 1:]]
+            if partition.vectors is not None:
+                partition.vectors = partition.vectors[keep]
+                partition.entries = [partition.entries[i] for i in keep]
+                partition.created = partition.created[keep]
+                partition.last_used = partition.last_used[keep]
+            partition.vectors = vector[None, :] if partition.vectors is None else np.vstack([partition.vectors, vector])
+            partition.entries.append(value)
+            partition.created = np.append(partition.created, now)
+            partition.last_used = np.append(partition.last_used, now)
+
+    def invalidate(self, store, parser, strategy, year, quarter):
+        """Drop every partition that includes this filing."""
+        with self._lock:
+            stale = [
+                key for key in self._partitions
+                if key[:4] == (store, parser, strategy, year) and quarter in key[4]
+            ]
+            for key in stale:
+                del self._partitions[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "partitions": len(self._partitions),
+                "entries": sum(len(p.entries) for p in self._partitions.values()),
+            }
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+answer_cache = SemanticAnswerCache()
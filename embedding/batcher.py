@@ -0,0 +1,80 @@
+import os
+import openai
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+from chunking.chunks import tokenizer
+from embedding.cache import cached_embeddings
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# OpenAI embeddings limits: inputs per request, tokens per request, tokens per input.
+EMBEDDING_MODEL = "text-embedding-3-small"
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+MAX_TOKENS_PER_INPUT = 8191
+
+# Batches in flight at once; also set OPENAI_BASE_URL to point at a stub server
+# (see embedding/stub_embedding_server.py) when testing locally.
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 100_000))
+
+def request_embeddings(texts, model=EMBEDDING_MODEL):
+    response = openai.embeddings.create(model=model, input=texts)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def embed_texts(texts, model=EMBEDDING_MODEL):
+    # Served from the shared on-disk cache; only uncached texts hit the API.
+    return cached_embeddings(texts, model, lambda missing: request_embeddings(missing, model))
+
+def pack_batches(items, text_of=lambda item: item, max_inputs=MAX_INPUTS_PER_REQUEST, max_tokens=EMBEDDING_BATCH_TOKENS):
+    """
+    Lazily group items into (items, texts) request batches that stay under the
+    per-request input and token limits. Inputs longer than the per-input limit
+    are clipped to it.
+    """
+    max_tokens = min(max_tokens, MAX_TOKENS_PER_REQUEST)
+    batch, texts, batch_tokens = [], [], 0
+
+    for item in items:
+        text = text_of(item)
+        tokens = tokenizer.encode(text)
+        if len(tokens) > MAX_TOKENS_PER_INPUT:
+            tokens = tokens[:MAX_TOKENS_PER_INPUT]
+            text = tokenizer.decode(tokens)
+
+        if batch and (len(batch) >= max_inputs or batch_tokens + len(tokens) > max_tokens):
+            yield batch, texts
+            batch, texts, batch_tokens = [], [], 0
+
+        batch.append(item)
+        texts.append(text)
+        batch_tokens += len(tokens)
+
+    if batch:
+        yield batch, texts
+
+def embed_batches(items, text_of=lambda item: item, concurrency=None, embed=embed_texts, **pack_kwargs):
+    """
+    Yield (item, embedding) pairs, one request batch at a time, in completion
+    order. At most `concurrency` requests are in flight, and items are pulled
+    from `items` only as request slots free up.
+    """
+    concurrency = concurrency or EMBEDDING_CONCURRENCY
+    batches = pack_batches(items, text_of, **pack_kwargs)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = {}
+        for batch, texts in batches:
+            pending[pool.submit(embed, texts)] = batch
+            if len(pending) < concurrency:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from zip(pending.pop(future), future.result())
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from zip(pending.pop(future), future.result())
@@ -0,0 +1,170 @@
+import os
+import re
+import gzip
+import json
+import math
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from embedding.index_cache import index_cache
+from embedding.fanout import fan_out
+
+# BM25 lexical index over one filing's chunks, built at ingestion from the
+# same records that are embedded. Each store decides where its index lives
+# (a "location": ("s3", key) or ("file", path)) so it sits next to that
+# store's data. Lexical search needs no embedding call; hybrid search fuses
+# the vector and lexical rankings with reciprocal rank fusion (RRF).
+
+load_dotenv()
+AWS_BUCKET = os.getenv("AWS_BUCKET_NAME")
+
+s3_client = boto3.client(
+    "s3",
+    region_name=os.getenv("AWS_REGION"),
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+)
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+RRF_K = 60
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    def __init__(self, texts, postings, doc_len, k1=1.5, b=0.75):
+        self.texts = texts
+        self.postings = postings
+        self.doc_len = np.asarray(doc_len, dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if len(texts) else 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75):
+        postings, doc_len = {}, []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(doc)
+                postings[token][1].append(tf)
+        postings = {
+            token: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for token, (docs, tfs) in postings.items()
+        }
+        return cls(list(texts), postings, doc_len, k1, b)
+
+    def to_json(self):
+        return {
+            "texts": self.texts,
+            "doc_len": self.doc_len.astype(int).tolist(),
+            "postings": {token: [docs.tolist(), tfs.astype(int).tolist()] for token, (docs, tfs) in self.postings.items()},
+            "k1": self.k1,
+            "b": self.b,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        postings = {
+            token: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for token, (docs, tfs) in data["postings"].items()
+        }
+        return cls(data["texts"], postings, data["doc_len"], data["k1"], data["b"])
+
+    @property
+    def nbytes(self):
+        return sum(len(text) for text in self.texts) + sum(d.nbytes + t.nbytes for d, t in self.postings.values())
+
+    def search(self, query, top_k=10):
+        """Return [(score, text)] of the top_k chunks, best first."""
+        n = len(self.texts)
+        scores = np.zeros(n, dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token not in self.postings:
+                continue
+            docs, tfs = self.postings[token]
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avg_len)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        matched = np.flatnonzero(scores)
+        top = matched[np.argsort(-scores[matched])[:top_k]]
+        return [(float(scores[i]), self.texts[i]) for i in top]
+
+def save_bm25(texts, location):
+    index = BM25Index.build(texts)
+    body = gzip.compress(json.dumps(index.to_json(), separators=(",", ":")).encode("utf-8"))
+    kind, target = location
+    if kind == "s3":
+        s3_client.put_object(Bucket=AWS_BUCKET, Key=target, Body=body, ContentType="application/json", ContentEncoding="gzip")
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(body)
+    index_cache.invalidate(f"{kind}:{target}")
+    print(f"🔤 Saved BM25 index for {len(texts)} chunks to {target} ({len(body)} bytes)")
+    return index
+
+def _location_etag(location):
+    kind, target = location
+    if kind == "s3":
+        try:
+            return s3_client.head_object(Bucket=AWS_BUCKET, Key=target)["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+    return os.path.getmtime(target) if os.path.exists(target) else None
+
+def load_bm25(location):
+    """Return the BM25Index at location (cached in-process), or None if it was never built."""
+    kind, target = location
+
+    def load():
+        etag = _location_etag(location)
+        if etag is None:
+            return None, None, 0
+        if kind == "s3":
+            body = s3_client.get_object(Bucket=AWS_BUCKET, Key=target)["Body"].read()
+        else:
+            with open(target, "rb") as f:
+                body = f.read()
+        index = BM25Index.from_json(json.loads(gzip.decompress(body)))
+        return index, etag, index.nbytes
+
+    return index_cache.get(f"{kind}:{target}", fetch_etag=lambda: _location_etag(location), load=load)
+
+def lexical_search(location_of, query, quarters, top_k):
+    """
+    BM25 search over each quarter's index (location_of(quarter)). Raw BM25
+    scores from separately built indexes are not comparable (idf and average
+    length differ), so quarters are merged by RRF score of their rankings.
+    """
+    def search_quarter(quarter):
+        index = load_bm25(location_of(quarter))
+        if index is None:
+            print(f"⚠️ No BM25 index at {location_of(quarter)[1]}")
+            return []
+        return [(1.0 / (RRF_K + rank), text) for rank, (_, text) in enumerate(index.search(query, top_k), start=1)]
+
+    return fan_out(quarters, search_quarter, top_k)
+
+def rrf_fuse(rankings, top_k, k=RRF_K):
+    """Fuse ranked lists of chunk texts: score = sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, text in enumerate(ranking, start=1):
+            scores[text] = scores.get(text, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+def check_mode(mode):
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"mode must be one of {SEARCH_MODES}")
@@ -0,0 +1,138 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+# On-disk embedding cache shared by the Pinecone, ChromaDB and manual stores.
+# Rows are keyed by (model, dimensions, sha256(text)) and hold the vector as
+# packed float32. Once the file holds more than EMBEDDING_CACHE_MAX_MB of
+# vectors, the least recently used rows are evicted.
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", 1024))
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._bytes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, dimensions INTEGER NOT NULL, text_hash TEXT NOT NULL,"
+                " vector BLOB NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (model, dimensions, text_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model, dimensions, texts):
+        """Return a list aligned with texts holding cached vectors or None."""
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            conn = self._connect()
+            found = {}
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND dimensions = ?"
+                    f" AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model, dimensions or 0, *chunk],
+                )
+                found.update(rows)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash = ?",
+                    [(now, model, dimensions or 0, h) for h in found],
+                )
+                conn.commit()
+
+            results = []
+            for h in hashes:
+                blob = found.get(h)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(array("f", blob).tolist())
+            return results
+
+    def put_many(self, model, dimensions, texts, vectors):
+        now = time.time()
+        rows = [
+            (model, dimensions or 0, text_hash(text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            conn = self._connect()
+            # Replaced rows are double counted until the next eviction resyncs.
+            conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._bytes += sum(len(row[3]) for row in rows)
+            if self._bytes > self.max_bytes:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        # Drop least recently used rows until the cache is back under 90% of the cap.
+        excess = self._bytes - int(self.max_bytes * 0.9)
+        victims = []
+        for model, dimensions, key, size in conn.execute(
+            "SELECT model, dimensions, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        ):
+            if excess <= 0:
+                break
+            victims.append((model, dimensions, key))
+            excess -= size
+        conn.executemany("DELETE FROM embeddings WHERE model = ? AND dimensions = ? AND text_hash = ?", victims)
+        self.evictions += len(victims)
+        self._bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self._bytes,
+            }
+
+embedding_cache = EmbeddingCache()
+
+def cached_embeddings(texts, model, embed, dimensions=None, cache=embedding_cache):
+    """
+    Embed texts through the cache: only texts without a stored vector are sent
+    to `embed` (in a single call), and their vectors are stored afterwards.
+    """
+    if not texts:
+        return []
+    vectors = cache.get_many(model, dimensions, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        fresh = embed([texts[i] for i in missing])
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+        cache.put_many(model, dimensions, [texts[i] for i in missing], fresh)
+    return vectors
@@ -0,0 +1,130 @@
+import os
+import time
+import json
+import shutil
+import argparse
+import numpy as np
+from chromadb import PersistentClient
+
+from embedding.chromadb import chroma_client, hnsw_metadata, _upsert_batch_size
+from embedding.batcher import embed_texts
+
+# Sweep Chroma HNSW settings on a copy of one collection from the local
+# persistent store. Every setting gets its own store under --workdir, is
+# filled with the source collection's stored embeddings (no re-embedding), and
+# is queried with a fixed query set. Reports build time, p50/p99 query latency,
+# recall@k against brute force and on-disk size.
+#
+#   python -m embedding.chroma_sweep --collection docling_heading --k 10
+
+DEFAULT_QUERIES = [
+    "What was total revenue for the quarter?",
+    "How did data center revenue change year over year?",
+    "What was diluted EPS?",
+    "Compute & Networking segment operating income",
+    "Gross margin and operating expenses",
+    "Cash flow from operating activities",
+    "Share repurchases and dividends",
+    "Outlook and guidance for next quarter",
+    "Gaming revenue trend",
+    "Inventory and supply commitments",
+]
+
+DEFAULT_SETTINGS = [
+    {"space": "cosine", "M": 16, "construction_ef": 100, "search_ef": 10},
+    {"space": "cosine", "M": 16, "construction_ef": 100, "search_ef": 50},
+    {"space": "cosine", "M": 16, "construction_ef": 200, "search_ef": 100},
+    {"space": "cosine", "M": 32, "construction_ef": 200, "search_ef": 100},
+    {"space": "cosine", "M": 48, "construction_ef": 400, "search_ef": 200},
+]
+
+def load_collection(name, page=1000):
+    collection = chroma_client.get_collection(name=name)
+    ids, embeddings, documents = [], [], []
+    for offset in range(0, collection.count(), page):
+        batch = collection.get(limit=page, offset=offset, include=["embeddings", "documents"])
+        ids.extend(batch["ids"])
+        embeddings.extend(batch["embeddings"])
+        documents.extend(batch["documents"])
+    return ids, np.asarray(embeddings, dtype=np.float32), documents
+
+def brute_force(vectors, queries, k, space):
+    if space == "cosine":
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    if space == "l2":
+        scores = -(np.sum(vectors ** 2, axis=1)[None, :] - 2 * queries @ vectors.T)
+    else:
+        scores = queries @ vectors.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def run_setting(setting, ids, vectors, documents, queries, k, workdir):
+    label = "-".join(f"{key}{value}" for key, value in setting.items())
+    path = os.path.join(workdir, label)
+    shutil.rmtree(path, ignore_errors=True)
+    client = PersistentClient(path=path)
+    collection = client.create_collection(name="sweep", metadata=hnsw_metadata(setting))
+
+    start = time.perf_counter()
+    batch_size = _upsert_batch_size()
+    for i in range(0, len(ids), batch_size):
+        collection.add(
+            ids=ids[i:i + batch_size],
+            embeddings=vectors[i:i + batch_size].tolist(),
+            documents=documents[i:i + batch_size],
+        )
+    build_seconds = time.perf_counter() - start
+
+    position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+    exact = brute_force(vectors, queries, k, setting.get("space", "l2"))
+    latencies, hits = [], 0
+    for query, truth in zip(queries, exact):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(truth & {position[chunk_id] for chunk_id in result["ids"][0]})
+
+    return {
+        "setting": setting,
+        "build_seconds": round(build_seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "recall_at_k": round(hits / (len(queries) * k), 4),
+        "disk_mb": round(dir_size(path) / 1e6, 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep Chroma HNSW settings for latency, recall and size.")
+    parser.add_argument("--collection", required=True, help="Source collection, e.g. docling_heading")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--settings", help="JSON list of settings; defaults to a small M/ef grid")
+    parser.add_argument("--queries", help="File with one query per line; defaults to a fixed financial query set")
+    parser.add_argument("--sample-queries", type=int, default=0,
+                        help="Use N stored chunk embeddings as queries instead (no embedding calls)")
+    parser.add_argument("--workdir", default="chromadb_sweep")
+    parser.add_argument("--keep", action="store_true", help="Keep the per-setting stores")
+    args = parser.parse_args()
+
+    ids, vectors, documents = load_collection(args.collection)
+    if args.sample_queries:
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), min(args.sample_queries, len(vectors)), replace=False)]
+    else:
+        texts = DEFAULT_QUERIES
+        if args.queries:
+            with open(args.queries, encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()]
+        queries = np.asarray(embed_texts(texts), dtype=np.float32)
+
+    settings = json.loads(args.settings) if args.settings else DEFAULT_SETTINGS
+    print(f"📊 {args.collection}: {len(ids)} vectors, {len(queries)} queries, k={args.k}")
+    for setting in settings:
+        row = run_setting(setting, ids, vectors, documents, queries, args.k, args.workdir)
+        print(f"🔹 {json.dumps(row['setting'])}  build {row['build_seconds']}s  p50 {row['p50_ms']} ms  "
+              f"p99 {row['p99_ms']} ms  recall@{args.k} {row['recall_at_k']}  disk {row['disk_mb']} MB")
+
+    if not args.keep:
+        shutil.rmtree(args.workdir, ignore_errors=True)
@@ -1,58 +1,160 @@
 # embedding/chromadb.py
 
 import os
+import json
+import threading
 from dotenv import load_dotenv
 import chromadb
 from chromadb import PersistentClient
-import chromadb.utils.embedding_functions as embedding_functions
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 
-from chunking.chunks import heading_based_split, semantic_split, recursive_split
+from chunking.artifacts import chunk_records
 from embedding.pinecone import load_markdown  # Reuse markdown loader from Pinecone
+from embedding.batcher import embed_texts, embed_batches
+from embedding.query_cache import embed_query
+from embedding.fanout import fan_out
+from embedding.ingest_diff import diff_chunks, diff_summary, save_ingest_state
+from embedding.bm25 import save_bm25, lexical_search, rrf_fuse, check_mode
 
 # Load environment variables
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Initialize persistent ChromaDB client
-chroma_client = PersistentClient(path="chromadb_store")
+CHROMA_PATH = "chromadb_store"
+chroma_client = PersistentClient(path=CHROMA_PATH)
+
+# OpenAI embedding function backed by the shared on-disk embedding cache
+class CachedOpenAIEmbeddingFunction(EmbeddingFunction[Documents]):
+    def __init__(self, model_name="text-embedding-3-small"):
+        self.model_name = model_name
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return embed_texts(list(input), model=self.model_name)
+
+openai_embedder = CachedOpenAIEmbeddingFunction(model_name="text-embedding-3-small")
+
+# Chunks per collection.upsert call, capped by the client's own batch limit
+CHROMA_UPSERT_BATCH = int(os.getenv("CHROMA_UPSERT_BATCH", 500))
+MAX_CHARS = 30000
+
+# HNSW settings per collection, e.g. CHROMA_HNSW_CONFIG='{"docling_heading": {"M": 32, "search_ef": 64}}'.
+# Keys: space ("l2" | "cosine" | "ip"), M, construction_ef, search_ef. space, M
+# and construction_ef are fixed when a collection is created; search_ef can be
+# changed on an existing collection.
+COLLECTION_HNSW = json.loads(os.getenv("CHROMA_HNSW_CONFIG", "{}"))
+HNSW_KEYS = ("space", "M", "construction_ef", "search_ef")
+
+def hnsw_metadata(hnsw):
+    unknown = set(hnsw or {}) - set(HNSW_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown HNSW settings: {sorted(unknown)}")
+    return {f"hnsw:{key}": value for key, value in (hnsw or {}).items()} or None
+
+def _search_ef(collection):
+    configuration = getattr(collection, "configuration", None)
+    if isinstance(configuration, dict) and (configuration.get("hnsw") or {}).get("ef_search") is not None:
+        return configuration["hnsw"]["ef_search"]
+    return (collection.metadata or {}).get("hnsw:search_ef")
+
+def _apply_hnsw(collection, hnsw):
+    current = collection.metadata or {}
+    wanted = hnsw_metadata(hnsw) or {}
+    fixed = [key for key in wanted if key != "hnsw:search_ef" and key in current and current[key] != wanted[key]]
+    if fixed:
+        print(f"⚠️ {collection.name} was created with different {fixed}; re-create it to apply them")
+    ef = wanted.get("hnsw:search_ef")
+    if ef is None or _search_ef(collection) == ef:
+        return
+    if hasattr(collection, "configuration"):
+        # chromadb >= 1.0 updates search ef through the collection configuration
+        collection.modify(configuration={"hnsw": {"ef_search": ef}})
+    else:
+        # Older releases replace the metadata and refuse any update carrying hnsw:space
+        metadata = {key: value for key, value in current.items() if key != "hnsw:space"}
+        collection.modify(metadata={**metadata, "hnsw:search_ef": ef})
+    applied = _search_ef(chroma_client.get_collection(name=collection.name, embedding_function=openai_embedder))
+    if applied != ef:
+        raise RuntimeError(f"search_ef of {collection.name} is still {applied}, not {ef}")
+    print(f"🔧 Set search_ef of {collection.name} to {ef}")
+
+# Collection handles are looked up once per process and reused by every
+# ingestion and query. HNSW settings (explicit or from CHROMA_HNSW_CONFIG) are
+# used when a collection is created and re-applied only at ingestion, never
+# from a query.
+_collections = {}
+_collections_lock = threading.Lock()
+
+def get_collection(parser, strategy, hnsw=None):
+    name = f"{parser}_{strategy}".lower()
+    with _collections_lock:
+        if name not in _collections:
+            _collections[name] = chroma_client.get_or_create_collection(
+                name=name,
+                embedding_function=openai_embedder,
+                metadata=hnsw_metadata(hnsw or COLLECTION_HNSW.get(name))
+            )
+        return _collections[name]
+
+def configure_collection(parser, strategy, hnsw=None):
+    """Ingestion only: get the collection and apply its HNSW settings (search_ef on existing ones)."""
+    name = f"{parser}_{strategy}".lower()
+    hnsw = hnsw or COLLECTION_HNSW.get(name)
+    collection = get_collection(parser, strategy, hnsw)
+    if hnsw:
+        with _collections_lock:
+            _apply_hnsw(collection, hnsw)
+    return collection
+
+def _upsert_batch_size():
+    # get_max_batch_size() in newer chromadb releases, max_batch_size before
+    if hasattr(chroma_client, "get_max_batch_size"):
+        return min(CHROMA_UPSERT_BATCH, chroma_client.get_max_batch_size())
+    return min(CHROMA_UPSERT_BATCH, getattr(chroma_client, "max_batch_size", CHROMA_UPSERT_BATCH))
 
-# Initialize OpenAI embedding function (Chroma-native wrapper)
-openai_embedder = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=OPENAI_API_KEY,
-    model_name="text-embedding-3-small"
-)
 #Save to chromadb
-def save_chunks_to_chromadb(parser, strategy, year, quarter, chunks):
-    collection_name = f"{parser}_{strategy}".lower()
-    collection = chroma_client.get_or_create_collection(
-        name=collection_name,
-        embedding_function=openai_embedder
-    )
-
-    print(f"📦 Preparing to upload {len(chunks)} chunks...")
-
-    # Trim long chunks to avoid OpenAI token limit
-    MAX_CHARS = 30000
-    trimmed_chunks = [chunk[:MAX_CHARS] for chunk in chunks]
-
-    documents = trimmed_chunks
-    ids = [f"{year}_{quarter}_{parser}_{strategy}_{i}" for i in range(len(documents))]
-    metadatas = [{
+# `records` carry ids from embedding.ingest_diff and may be a lazy iterator.
+# Chunks are embedded outside Chroma in token-packed requests (several in
+# flight at once) and upserted with their precomputed embeddings.
+def save_chunks_to_chromadb(parser, strategy, year, quarter, records, hnsw=None):
+    collection = get_collection(parser, strategy, hnsw)
+    batch_size = _upsert_batch_size()
+    metadata = {
         "year": year,
         "quarter": quarter,
         "parser": parser,
         "strategy": strategy,
         "period": f"{year}_Q{quarter[-1]}"
-    } for _ in documents]
+    }
+    uploaded = 0
+    ids, embeddings, documents = [], [], []
+
+    def flush():
+        nonlocal uploaded
+        collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=[metadata] * len(ids))
+        uploaded += len(ids)
+        print(f"📦 Upserted {len(ids)} chunks ({uploaded} so far)...")
+        ids.clear()
+        embeddings.clear()
+        documents.clear()
 
-    collection.add(documents=documents, metadatas=metadatas, ids=ids)
+    # Trim long chunks to avoid OpenAI token limit
+    chunks = ((record["id"], record["text"][:MAX_CHARS]) for record in records)
+    for (chunk_id, document), embedding in embed_batches(chunks, text_of=lambda item: item[1]):
+        ids.append(chunk_id)
+        embeddings.append(embedding)
+        documents.append(document)
+        if len(ids) >= batch_size:
+            flush()
+    if ids:
+        flush()
 
-    print(f"✅ Uploaded {len(documents)} chunks to ChromaDB in collection: {collection_name}")
-    return {"status": "success", "chunks_uploaded": len(documents)}
+    print(f"✅ Uploaded {uploaded} chunks to ChromaDB in collection: {collection.name}")
+    return {"status": "success", "chunks_uploaded": uploaded}
 
 
 # === Convert Markdown → Chunks → Upload to ChromaDB ===
-def process_and_upload_to_chromadb(year, quarter, parser, strategy):
+def process_and_upload_to_chromadb(year, quarter, parser, strategy, hnsw=None):
     print(f"📥 Loading markdown from S3 for: {parser.upper()} - {year} {quarter}")
     markdown = load_markdown(year, quarter, parser)
     
@@ -60,39 +162,70 @@ def process_and_upload_to_chromadb(year, quarter, parser, strategy):
         raise ValueError("❌ Markdown file could not be loaded from S3.")
 
     print(f"✂️ Chunking strategy: {strategy}")
-    if strategy == "heading":
-        chunks = heading_based_split(markdown)
-    elif strategy == "semantic":
-        chunks = semantic_split(markdown)
-    elif strategy == "recursive":
-        chunks = recursive_split(markdown)
-    else:
-        raise ValueError("❌ Invalid chunking strategy.")
-    
-    print(f"📦 Total chunks generated: {len(chunks)}")
-    return save_chunks_to_chromadb(parser, strategy, year, quarter, chunks)
-
+    records = chunk_records(markdown, year, quarter, parser, strategy)
+
+    # Only changed chunks are embedded; chunks no longer produced are deleted.
+    # The state lives in S3 but the store is local and may have been wiped
+    # (e.g. a rebuilt container), so the state is checked against the collection.
+    collection = configure_collection(parser, strategy, hnsw)
+    period = {"period": f"{year}_Q{quarter[-1]}"}
+    stored_ids = lambda: collection.get(where=period, include=[])["ids"]
+    diff = diff_chunks("chromadb", records, year, quarter, parser, strategy, stored_ids=stored_ids)
+    if diff.first_run:
+        # Clear chunks from an ingestion that predates the tracked state
+        collection.delete(where=period)
+    save_chunks_to_chromadb(parser, strategy, year, quarter, diff.added, hnsw)
+    if diff.removed:
+        collection.delete(ids=diff.removed)
+        print(f"🗑️ Deleted {len(diff.removed)} stale chunks from ChromaDB")
+    save_bm25([text[:MAX_CHARS] for text in diff.texts], bm25_location(year, quarter, parser, strategy))
+    save_ingest_state("chromadb", year, quarter, parser, strategy, diff.ids)
+    return {"status": "success", **diff_summary(diff)}
+
+
+# The BM25 index lives inside the local Chroma store directory
+def bm25_location(year, quarter, parser, strategy):
+    return ("file", os.path.join(CHROMA_PATH, "bm25", f"{parser}_{strategy}".lower(), f"{year}_{quarter}.json.gz"))
 
 # === Query ChromaDB Collection ===
-def search_chunks(parser, strategy, query, year, quarters, top_k=30):
-    if len(quarters) != 1:
-        raise ValueError("ChromaDB only supports filtering by a single quarter (period).")
-
-    collection_name = f"{parser}_{strategy}".lower()
-
-    collection = chroma_client.get_or_create_collection(
-        name=collection_name,
-        embedding_function=openai_embedder
-    )
-
-    period_key = f"{year}_Q{quarters[0][-1]}"
-
+# Each quarter (period) is queried as its own shard, concurrently, and merged
+# into a global top_k by distance (see embedding/fanout.py). mode="lexical"
+# answers from the BM25 index without embedding the query; "hybrid" fuses both.
+def search_chunks(parser, strategy, query, year, quarters, top_k=30, mode="vector", query_vector=None):
+    check_mode(mode)
+    if mode == "lexical":
+        return lexical_search(lambda quarter: bm25_location(year, quarter, parser, strategy), query, quarters, top_k)
+    if mode == "hybrid":
+        return rrf_fuse([
+            search_chunks(parser, strategy, query, year, quarters, 2 * top_k, "vector", query_vector),
+            search_chunks(parser, strategy, query, year, quarters, 2 * top_k, "lexical"),
+        ], top_k)
+
+    collection = get_collection(parser, strategy)
+    embedded_query = query_vector if query_vector is not None else embed_query(query)
+
+    def search_period(quarter):
+        results = collection.query(
+            query_embeddings=[embedded_query],
+            n_results=top_k,
+            where={"period": f"{year}_Q{quarter[-1]}"},
+            include=["documents", "distances"]
+        )
+        documents = results.get("documents", [[]])[0]
+        distances = results.get("distances", [[]])[0]
+        # Smaller distance is better, so negate it as the score
+        return [(-distance, document) for document, distance in zip(documents, distances)]
+
+    return fan_out(quarters, search_period, top_k)
+
+# Many questions against one filing: a single multi-vector query on the
+# collection. Returns one list of chunk texts per query vector.
+def search_chunks_batch(parser, strategy, query_vectors, year, quarter, top_k=30):
+    collection = get_collection(parser, strategy)
     results = collection.query(
-        query_texts=[query],
+        query_embeddings=[list(vector) for vector in query_vectors],
         n_results=top_k,
-        where={"period": period_key},
-        include=["documents", "metadatas"]
+        where={"period": f"{year}_Q{quarter[-1]}"},
+        include=["documents"]
     )
-
-    documents = results.get("documents", [[]])[0]
-    return documents
+    return results.get("documents") or [[] for _ in query_vectors]
@@ -0,0 +1,110 @@
+import os
+import argparse
+
+from chunking.chunks import tokenizer, iter_chunks, STRATEGY_LIMITS
+
+# Token-budgeted prompt context. Retrieved chunks (best first) are
+# de-duplicated, re-ordered with maximal marginal relevance (MMR) so that
+# near-duplicates do not crowd out other evidence, and added whole until the
+# token budget is full. Similarity is the Jaccard overlap of token trigrams,
+# so packing needs no extra embedding calls.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3500))
+# The budget always fits this many whole chunks of the strategy's maximum size
+# (the Pinecone routes used to send their top 5 chunks unchanged), so recursive
+# and heading chunks are not cut down to CONTEXT_TOKEN_BUDGET.
+CONTEXT_MIN_CHUNKS = int(os.getenv("CONTEXT_MIN_CHUNKS", 5))
+MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+# Chunks sharing more than this fraction of the smaller chunk's trigrams are duplicates
+DUPLICATE_OVERLAP = float(os.getenv("CONTEXT_DUPLICATE_OVERLAP", 0.8))
+SEPARATOR = "\n\n"
+
+def _shingles(tokens, n=3):
+    return {tuple(tokens[i:i + n]) for i in range(max(1, len(tokens) - n + 1))}
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _containment(a, b):
+    return len(a & b) / min(len(a), len(b)) if a and b else 0.0
+
+pack_stats = {"packs": 0, "truncated": 0}
+
+def context_budget(strategy=None):
+    limit = STRATEGY_LIMITS.get((strategy or "").lower(), 0)
+    separator_tokens = len(tokenizer.encode(SEPARATOR))
+    return max(CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_CHUNKS * (limit + separator_tokens))
+
+def pack_context(chunks, budget=None, strategy=None, mmr_lambda=MMR_LAMBDA, duplicate_overlap=DUPLICATE_OVERLAP):
+    """
+    Return (context, packed_chunks) for chunks ranked best first, using at
+    most `budget` tokens (context_budget(strategy) by default). Chunks are
+    not cut; one that does not fit is skipped in favour of later, shorter
+    ones. Only when no chunk fits at all is the best one truncated at a token
+    boundary.
+    """
+    budget = budget or context_budget(strategy)
+    chunks = [chunk for chunk in chunks if chunk and chunk.strip()]
+    if not chunks:
+        return "", []
+
+    tokens = tokenizer.encode_batch(chunks)
+    shingles = [_shingles(t) for t in tokens]
+
+    # Drop exact and overlapping duplicates, keeping the better-ranked copy
+    kept = []
+    for i in range(len(chunks)):
+        if all(_containment(shingles[i], shingles[j]) < duplicate_overlap for j in kept):
+            kept.append(i)
+
+    # Relevance from retrieval rank: 1.0 for the best chunk down towards 0
+    relevance = {i: 1.0 - rank / len(kept) for rank, i in enumerate(kept)}
+    separator_tokens = len(tokenizer.encode(SEPARATOR))
+    selected, used = [], 0
+    remaining = list(kept)
+    while remaining:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max(
+            (_jaccard(shingles[i], shingles[j]) for j in selected), default=0.0))
+        remaining.remove(best)
+        cost = len(tokens[best]) + (separator_tokens if selected else 0)
+        if used + cost > budget:
+            continue
+        selected.append(best)
+        used += cost
+
+    # Present chunks in retrieval order
+    packed = [chunks[i] for i in sorted(selected)]
+    pack_stats["packs"] += 1
+    if not packed:
+        pack_stats["truncated"] += 1
+        # Even the best chunk exceeds the budget (chunks can be up to 8192
+        # tokens): keep its leading `budget` tokens rather than send no context
+        best = kept[0]
+        packed = [tokenizer.decode(tokens[best][:budget])]
+        used = min(len(tokens[best]), budget)
+        print(f"✂️ Top chunk ({len(tokens[best])} tokens) exceeds the {budget}-token budget; truncated")
+    print(f"🧱 Packed {len(packed)}/{len(chunks)} chunks into {used}/{budget} tokens "
+          f"({len(chunks) - len(kept)} duplicates dropped)")
+    return SEPARATOR.join(packed), packed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the default budget packs the largest chunks of each strategy whole.")
+    parser.add_argument("--input", default="chunking/Q1 (1).md", help="Path to Markdown input file.")
+    parser.add_argument("--strategy", choices=list(STRATEGY_LIMITS), nargs="+", default=list(STRATEGY_LIMITS))
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as file:
+        markdown_data = file.read()
+
+    failed = False
+    for strategy in args.strategy:
+        # Worst case for the budget: the CONTEXT_MIN_CHUNKS largest chunks of the document
+        texts = sorted((record["text"] for record in iter_chunks(markdown_data, strategy)), key=len, reverse=True)
+        truncated = pack_stats["truncated"]
+        _, packed = pack_context(texts[:CONTEXT_MIN_CHUNKS], strategy=strategy)
+        whole = len(packed) == min(CONTEXT_MIN_CHUNKS, len(texts)) and pack_stats["truncated"] == truncated
+        failed |= not whole
+        print(f"{'✅' if whole else '❌'} {strategy}: budget {context_budget(strategy)} tokens, "
+              f"{len(packed)}/{min(CONTEXT_MIN_CHUNKS, len(texts))} largest chunks packed whole")
+    if failed:
+        raise SystemExit(1)
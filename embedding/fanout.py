@@ -0,0 +1,41 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Multi-period retrieval: every (year, quarter) period is searched as its own
+# shard, concurrently, and the per-shard hits are merged into one global top-k
+# by score. A shard that has not answered within SHARD_DEADLINE_SECONDS is
+# dropped from the result instead of stalling the whole answer.
+
+SHARD_DEADLINE_SECONDS = float(os.getenv("SHARD_DEADLINE_SECONDS", 5))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 8))
+
+def fan_out(shards, search_shard, top_k, deadline=SHARD_DEADLINE_SECONDS, concurrency=FANOUT_CONCURRENCY):
+    """
+    Run search_shard(shard) -> [(score, text)] for every shard and return the
+    texts of the global top_k hits, best first (higher score is better).
+    """
+    shards = list(shards)
+    if len(shards) == 1:
+        hits = search_shard(shards[0])
+        return [text for _, text in sorted(hits, key=lambda hit: hit[0], reverse=True)[:top_k]]
+
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(shards))))
+    futures = {executor.submit(search_shard, shard): shard for shard in shards}
+    done, pending = wait(futures, timeout=deadline)
+    # Don't wait for stragglers; their results are discarded
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    hits = []
+    for future in done:
+        try:
+            hits.extend(future.result())
+        except Exception as e:
+            print(f"⚠️ Shard {futures[future]} failed: {e}")
+    for future in pending:
+        print(f"⏱️ Shard {futures[future]} missed the {deadline:.1f}s deadline, skipping")
+
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    print(f"🔀 Merged {len(hits)} hits from {len(done)}/{len(shards)} shards in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return [text for _, text in hits[:top_k]]
@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Process-wide cache for loaded index shards (e.g. one manual index per
+# year/quarter), keyed by S3 key. An entry is trusted for `revalidate_after`
+# seconds; after that a cheap ETag lookup decides whether it is still current
+# or must be reloaded. Shards are evicted least-recently-used first once their
+# combined size exceeds `max_bytes`.
+
+INDEX_CACHE_MAX_MB = int(os.getenv("INDEX_CACHE_MAX_MB", 2048))
+INDEX_CACHE_REVALIDATE_SECONDS = float(os.getenv("INDEX_CACHE_REVALIDATE_SECONDS", 30))
+
+class ShardCache:
+    def __init__(self, max_bytes=INDEX_CACHE_MAX_MB * 1024 * 1024, revalidate_after=INDEX_CACHE_REVALIDATE_SECONDS):
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self._entries = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, fetch_etag, load):
+        """
+        Return the cached value for key, reloading it when its ETag changed.
+
+        fetch_etag() -> current ETag of the source object
+        load() -> (value, etag, size_in_bytes)
+        """
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                stats = self._stats.setdefault(key, {"hits": 0, "loads": 0, "revalidations": 0, "load_seconds": []})
+
+            if entry:
+                if time.monotonic() - entry["checked"] < self.revalidate_after:
+                    return self._hit(key, entry, stats)
+                stats["revalidations"] += 1
+                if fetch_etag() == entry["etag"]:
+                    entry["checked"] = time.monotonic()
+                    return self._hit(key, entry, stats)
+
+            start = time.perf_counter()
+            value, etag, size = load()
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self._entries[key] = {"value": value, "etag": etag, "size": size, "checked": time.monotonic()}
+                self._entries.move_to_end(key)
+                stats["loads"] += 1
+                stats["load_seconds"] = (stats["load_seconds"] + [round(elapsed, 4)])[-10:]
+                self._evict()
+            print(f"📥 Loaded index shard {key} in {elapsed * 1000:.0f} ms ({size / 1e6:.1f} MB)")
+            return value
+
+    def _hit(self, key, entry, stats):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            stats["hits"] += 1
+        return entry["value"]
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self._entries.values())
+        # Always keep the most recently loaded shard, even if it alone is over budget
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry["size"]
+            print(f"🧹 Evicted index shard {key} ({entry['size'] / 1e6:.1f} MB)")
+
+    def resize(self, key, value, size):
+        """Record that a resident value grew or shrank after load (e.g. a row cache it fills lazily)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["value"] is value:
+                entry["size"] = size
+                self._evict()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "shards": {
+                    key: {**stats, "resident": key in self._entries,
+                          "bytes": self._entries[key]["size"] if key in self._entries else 0}
+                    for key, stats in self._stats.items()
+                },
+            }
+
+index_cache = ShardCache()
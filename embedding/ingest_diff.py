@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import boto3
+from dotenv import load_dotenv
+
+# Incremental re-ingestion. Chunk ids are derived from the chunk's content
+# hash, so a chunk keeps its id when text before it changes. For every
+# (store, year, quarter, parser, strategy) the ids last written are kept in
+#   ingest_state/{store}/{year}/{quarter}/{parser}_{strategy}.json
+# and a new ingestion only embeds/upserts ids that are not in that state and
+# deletes ids that are no longer produced. The state is saved only after the
+# store was updated, so a failed run is simply retried in full next time.
+
+load_dotenv()
+AWS_BUCKET = os.getenv("AWS_BUCKET_NAME")
+
+s3_client = boto3.client(
+    "s3",
+    region_name=os.getenv("AWS_REGION"),
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+)
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def state_key(store, year, quarter, parser, strategy):
+    return f"ingest_state/{store}/{year}/{quarter}/{parser}_{strategy}.json"
+
+def load_ingest_state(store, year, quarter, parser, strategy):
+    """Return the stored {"ids": [...]} state, or None if this filing was never ingested."""
+    try:
+        response = s3_client.get_object(Bucket=AWS_BUCKET, Key=state_key(store, year, quarter, parser, strategy))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read())
+
+def save_ingest_state(store, year, quarter, parser, strategy, ids):
+    body = json.dumps({"ids": sorted(ids)}, separators=(",", ":"))
+    s3_client.put_object(Bucket=AWS_BUCKET, Key=state_key(store, year, quarter, parser, strategy), Body=body, ContentType="application/json")
+
+def with_chunk_ids(records, year, quarter, parser, strategy):
+    """Attach a content-derived "id" to each record; repeated chunks get an occurrence suffix."""
+    seen = {}
+    for record in records:
+        digest = chunk_hash(record["text"])[:16]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        suffix = f"_{occurrence}" if occurrence else ""
+        yield {**record, "id": f"{year}_{quarter}_{parser}_{strategy}_{digest}{suffix}"}
+
+class ChunkDiff:
+    """
+    Freshly chunked records compared against what a store holds for a filing.
+
+    `added` is a generator: records are hashed and checked as it is consumed,
+    so embedding starts with the first chunk. `ids`, `texts` (every current
+    chunk, for the BM25 index), `removed` and `unchanged` are complete once
+    `added` has been exhausted. On a first run every record is added and the
+    caller should clear whatever an older, untracked ingestion left behind.
+    """
+    def __init__(self, store, records, year, quarter, parser, strategy, state):
+        self.label = f"{store} diff for {year} {quarter} {parser}/{strategy}"
+        self.first_run = state is None
+        self.stored = set(state["ids"]) if state else set()
+        self.ids, self.texts = [], []
+        self.added_count = 0
+        self.done = False
+        self.added = self._added(with_chunk_ids(records, year, quarter, parser, strategy))
+
+    def _added(self, records):
+        for record in records:
+            self.ids.append(record["id"])
+            self.texts.append(record["text"])
+            if record["id"] not in self.stored:
+                self.added_count += 1
+                yield record
+        self.done = True
+        print(f"🧮 {self.label}: {self.added_count} added, {len(self.removed)} removed, {self.unchanged} unchanged")
+
+    def _check_done(self):
+        if not self.done:
+            raise RuntimeError(f"{self.label} is incomplete until its added records are consumed")
+
+    @property
+    def removed(self):
+        self._check_done()
+        return sorted(self.stored - set(self.ids))
+
+    @property
+    def unchanged(self):
+        self._check_done()
+        return len(self.ids) - self.added_count
+
+def diff_chunks(store, records, year, quarter, parser, strategy, stored_ids=None):
+    """
+    Return a ChunkDiff of `records` (which may be a lazy iterator) against
+    the saved ingest state of the filing. The state is loaded up front.
+
+    `stored_ids`, if given, returns the ids the store really holds for the
+    filing. For stores that can lose data independently of the saved state
+    (the local Chroma store), a state that disagrees with it is discarded and
+    the ingestion is treated as a first run.
+    """
+    state = load_ingest_state(store, year, quarter, parser, strategy)
+    if state is not None and stored_ids is not None and set(stored_ids()) != set(state["ids"]):
+        print(f"⚠️ {store} no longer matches its ingest state for {year} {quarter} {parser}/{strategy}; re-ingesting in full")
+        state = None
+    return ChunkDiff(store, records, year, quarter, parser, strategy, state)
+
+def diff_summary(diff):
+    return {
+        "chunks_uploaded": diff.added_count,
+        "chunks_deleted": len(diff.removed),
+        "chunks_unchanged": diff.unchanged,
+    }
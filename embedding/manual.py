@@ -1,12 +1,27 @@
 import os
+import io
+import gzip
+import json
+import time
+import uuid
 import pickle
-import openai
+import threading
+from collections import OrderedDict
 import boto3
 import numpy as np
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
 
-from chunking.chunks import heading_based_split, semantic_split, recursive_split
+from chunking.chunks import batch_records
+from chunking.artifacts import chunk_records
+from embedding.batcher import embed_texts
+from embedding.query_cache import embed_query
+from embedding.index_cache import index_cache
+from embedding.ann import IVFIndex
+from embedding.quantization import MANUAL_QUANTIZATION, QuantizedIndex
+from concurrent.futures import ThreadPoolExecutor
+from embedding.ingest_diff import diff_chunks, diff_summary, save_ingest_state
+from embedding.bm25 import save_bm25, load_bm25, rrf_fuse, check_mode
 
 # Load credentials from .env
 load_dotenv()
@@ -14,7 +29,18 @@ AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Local directory the columnar index files are downloaded to and mmapped from
+MANUAL_INDEX_DIR = os.getenv("MANUAL_INDEX_DIR", "manual_index")
+META_COLUMNS = ["year", "quarter", "parser", "strategy", "content"]
+# Quantized segments read rescoring rows with ranged GETs: candidate rows at
+# most RESCORE_MERGE_GAP rows apart share one request
+RESCORE_MERGE_GAP = int(os.getenv("MANUAL_RESCORE_MERGE_GAP", 16))
+RESCORE_FETCH_CONCURRENCY = int(os.getenv("MANUAL_RESCORE_FETCH_CONCURRENCY", 8))
+# Fetched rows kept per segment (least recently used dropped first)
+RESCORE_CACHE_ROWS = int(os.getenv("MANUAL_RESCORE_CACHE_ROWS", 4096))
+# Queries scored per matrix product in batch search; bounds the (queries x rows) score matrix
+BATCH_QUERY_BLOCK = int(os.getenv("MANUAL_BATCH_QUERY_BLOCK", 256))
 
 # Initialize S3 client
 s3 = boto3.client(
@@ -26,57 +52,535 @@ s3 = boto3.client(
 
 # ========== EMBEDDING ==========
 def generate_embeddings(texts):
-    response = openai.embeddings.create(
-        model="text-embedding-3-small",
-        input=texts
-    )
-    return [item.embedding for item in response.data]
+    return embed_texts(texts, model="text-embedding-3-small")
 
 # ========== VECTOR CREATION ==========
-def create_manual_vector_index(markdown, year, quarter, parser, strategy):
-    # Choose chunking strategy
-    if strategy == "heading":
-        chunks = heading_based_split(markdown)
-    elif strategy == "semantic":
-        chunks = semantic_split(markdown)
-    elif strategy == "recursive":
-        chunks = recursive_split(markdown)
+def create_manual_vector_index(markdown, year, quarter, parser, strategy, batch_size=100):
+    """
+    Embed and store only the chunks that changed since the last ingestion of
+    this filing; returns the diff summary (see embedding/ingest_diff.py).
+    """
+    records = chunk_records(markdown, year, quarter, parser, strategy)
+    diff = diff_chunks("manual", records, year, quarter, parser, strategy)
+
+    data = []
+    for batch in batch_records(diff.added, batch_size):
+        vectors = generate_embeddings([record["text"] for record in batch])
+        for record, vector in zip(batch, vectors):
+            data.append({
+                "id": record["id"],
+                "embedding": vector,
+                "meta": {
+                    "year": year,
+                    "quarter": quarter,
+                    "parser": parser,
+                    "strategy": strategy,
+                    "content": record["text"]
+                }
+            })
+
+    print(f"🧩 Chunks embedded: {len(data)}")
+    if diff.first_run:
+        # Untracked earlier ingestion: replace this parser/strategy's segments outright
+        append_segment(data, year, quarter, parser, strategy, mode="replace")
+    elif data or diff.removed:
+        append_segment(data, year, quarter, parser, strategy, mode="upsert", deleted=diff.removed)
+    save_bm25(diff.texts, bm25_location(year, quarter, parser, strategy))
+    save_ingest_state("manual", year, quarter, parser, strategy, diff.ids)
+    return {"status": "success", **diff_summary(diff)}
+
+# ========== COLUMNAR INDEX ==========
+# A columnar index is two S3 objects under one prefix:
+#   vectors.npy   - float32 matrix (rows L2-normalized, so dot product = cosine)
+#   meta.json.gz  - {"ids": [...], "year": [...], ..., "content": [...]} columns
+# plus quantized_{kind}.npz (codes and int8 scales) when MANUAL_QUANTIZATION is set.
+# Segments of the sharded store (below) use this layout, as does the older
+# single index per quarter at manual_embedding/{year}/Q{n}/. The legacy
+# manual_vectors.pkl (list of dicts) is still read when neither exists.
+
+def manual_index_prefix(year, quarter):
+    return f"manual_embedding/{year}/Q{quarter[-1]}"
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def build_columnar_index(data):
+    vectors = np.asarray([entry["embedding"] for entry in data], dtype=np.float32)
+    vectors = normalize_rows(vectors.reshape(len(data), -1) if data else np.zeros((0, 0), dtype=np.float32))
+    columns = {"ids": [entry["id"] for entry in data]}
+    for name in META_COLUMNS:
+        columns[name] = [entry["meta"][name] for entry in data]
+    return vectors, columns
+
+def _put_columnar(prefix, vectors, columns, quantization=MANUAL_QUANTIZATION):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(vectors, dtype=np.float32), allow_pickle=False)
+    s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}/vectors.npy", Body=buffer.getvalue())
+
+    meta = gzip.compress(json.dumps(columns, separators=(",", ":")).encode("utf-8"))
+    s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}/meta.json.gz", Body=meta)
+
+    if quantization != "none" and vectors.size:
+        # Codes (and int8 scales) are stored so loading never needs the float32 matrix
+        codes = QuantizedIndex.build(vectors, quantization).to_bytes()
+        s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}/quantized_{quantization}.npz", Body=codes)
+    index_cache.invalidate(f"{prefix}/vectors.npy")
+
+def _get_columns(prefix):
+    response = s3.get_object(Bucket=BUCKET_NAME, Key=f"{prefix}/meta.json.gz")
+    return json.loads(gzip.decompress(response["Body"].read()))
+
+def _download_vectors(prefix):
+    # Download the matrix next to MANUAL_INDEX_DIR and memory-map it
+    local_dir = os.path.join(MANUAL_INDEX_DIR, prefix)
+    os.makedirs(local_dir, exist_ok=True)
+    vectors_path = os.path.join(local_dir, "vectors.npy")
+    s3.download_file(BUCKET_NAME, f"{prefix}/vectors.npy", vectors_path)
+    return np.load(vectors_path, mmap_mode="r")
+
+def _download_columnar(prefix):
+    try:
+        return _download_vectors(prefix), _get_columns(prefix)
+    except ClientError as e:
+        raise RuntimeError(f"Failed to load vectors from S3: {str(e)}")
+
+class RemoteRows:
+    """
+    The float32 rows of a segment's vectors.npy, left in S3. Indexing with
+    row numbers fetches just those rows with ranged GETs (nearby rows share
+    a request) and keeps up to RESCORE_CACHE_ROWS of them, calling
+    on_resize(nbytes) when that cache changes size. Boolean masks and
+    np.asarray() download the whole matrix for bulk readers such as
+    compaction and the ANN build; it is not kept.
+    """
+    def __init__(self, prefix, shape, offset, max_rows=RESCORE_CACHE_ROWS):
+        self.prefix = prefix
+        self.shape = shape
+        self.offset = offset
+        self.row_bytes = shape[1] * 4
+        self.max_rows = max_rows
+        self.on_resize = None
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, prefix):
+        head = s3.get_object(Bucket=BUCKET_NAME, Key=f"{prefix}/vectors.npy", Range="bytes=0-4095")["Body"].read()
+        header = io.BytesIO(head)
+        version = np.lib.format.read_magic(header)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(header)
+        if fortran_order or dtype != np.float32 or len(shape) != 2:
+            raise ValueError(f"Unexpected vectors.npy layout in {prefix}")
+        return cls(prefix, shape, header.tell())
+
+    @property
+    def nbytes(self):
+        return len(self._rows) * self.row_bytes
+
+    def materialize(self):
+        return _download_vectors(self.prefix)
+
+    def __array__(self, dtype=None, copy=None):
+        full = self.materialize()
+        return np.asarray(full, dtype=dtype) if dtype else np.asarray(full)
+
+    def _fetch_range(self, first, last):
+        start = self.offset + first * self.row_bytes
+        end = self.offset + (last + 1) * self.row_bytes - 1
+        body = s3.get_object(Bucket=BUCKET_NAME, Key=f"{self.prefix}/vectors.npy", Range=f"bytes={start}-{end}")["Body"].read()
+        return first, np.frombuffer(body, dtype=np.float32).reshape(-1, self.shape[1])
+
+    def __getitem__(self, rows):
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            return self.materialize()[rows]
+        if rows.size == 0:
+            return np.zeros((0, self.shape[1]), dtype=np.float32)
+
+        found = {}
+        with self._lock:
+            for row in set(rows.tolist()):
+                if row in self._rows:
+                    self._rows.move_to_end(row)
+                    found[row] = self._rows[row]
+        missing = sorted(set(rows.tolist()) - found.keys())
+        if not missing:
+            return np.stack([found[row] for row in rows.tolist()])
+
+        ranges = []
+        for row in missing:
+            if ranges and row - ranges[-1][1] <= RESCORE_MERGE_GAP:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        with ThreadPoolExecutor(max_workers=min(RESCORE_FETCH_CONCURRENCY, len(ranges))) as pool:
+            for first, block in pool.map(lambda r: self._fetch_range(*r), ranges):
+                for i, vector in enumerate(block):
+                    found[first + i] = vector
+
+        with self._lock:
+            for row in missing:
+                # Copy, so a kept row does not pin the whole response buffer
+                self._rows[row] = found[row].copy()
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+            nbytes = self.nbytes
+        if self.on_resize:
+            self.on_resize(nbytes)
+        return np.stack([found[row] for row in rows.tolist()])
+
+def _get_quantized(prefix, quantization):
+    try:
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=f"{prefix}/quantized_{quantization}.npz")
+    except s3.exceptions.NoSuchKey:
+        return None
+    return QuantizedIndex.from_bytes(response["Body"].read())
+
+def _load_segment_index(prefix, quantization=MANUAL_QUANTIZATION):
+    if quantization != "none":
+        quantized = _get_quantized(prefix, quantization)
+        if quantized is not None:
+            # Load codes and metadata only; float32 rows are fetched when rescored
+            columns = {k: np.asarray(v) for k, v in _get_columns(prefix).items()}
+            index = {"vectors": RemoteRows.open(prefix), "columns": columns, "quantized": quantized}
+            return index, quantized.nbytes + sum(column.nbytes for column in columns.values())
+    # Segments written without stored codes: download the matrix (codes are built from it)
+    return _as_index(*_download_columnar(prefix), quantization)
+
+def _as_index(vectors, columns, quantization=MANUAL_QUANTIZATION):
+    index = {"vectors": vectors, "columns": {k: np.asarray(v) for k, v in columns.items()}}
+    size = sum(column.nbytes for column in index["columns"].values())
+    if quantization != "none" and vectors.size:
+        # Search scans the resident codes; memory-mapped rows are only paged in for rescoring
+        index["quantized"] = QuantizedIndex.build(vectors, quantization)
+        size += index["quantized"].nbytes
+        if not isinstance(vectors, np.memmap):
+            size += vectors.nbytes
     else:
-        raise ValueError("Unsupported chunking strategy.")
+        size += vectors.nbytes
+    return index, size
 
-    print(f"🧩 Total chunks generated: {len(chunks)}")
-    vectors = generate_embeddings(chunks)
+def _object_etag(key):
+    try:
+        return s3.head_object(Bucket=BUCKET_NAME, Key=key)["ETag"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
 
-    data = []
-    for idx, vector in enumerate(vectors):
-        data.append({
-            "id": f"{year}_{quarter}_{parser}_{strategy}_chunk_{idx}",
-            "embedding": vector,
-            "meta": {
-                "year": year,
-                "quarter": quarter,
-                "parser": parser,
-                "strategy": strategy,
-                "content": chunks[idx]
-            }
-        })
+def _manual_index_etag(year, quarter):
+    prefix = manual_index_prefix(year, quarter)
+    vectors_etag = _object_etag(f"{prefix}/vectors.npy")
+    if vectors_etag is None:
+        return f"pickle:{_object_etag(f'{prefix}/manual_vectors.pkl')}"
+    return f"{vectors_etag}:{_object_etag(f'{prefix}/meta.json.gz')}"
 
-    upload_pickle_to_s3(data, year, quarter)
-    return data
+def _fetch_manual_index(year, quarter):
+    etag = _manual_index_etag(year, quarter)
+    if etag.startswith("pickle:"):
+        # No columnar index yet: fall back to the legacy pickle
+        vectors, columns = build_columnar_index(download_pickle_from_s3(year, quarter))
+    else:
+        vectors, columns = _download_columnar(manual_index_prefix(year, quarter))
+    index, size = _as_index(vectors, columns)
+    return index, etag, size
 
-# ========== S3 UPLOAD ==========
-def upload_pickle_to_s3(data, year, quarter):
-    pickle_path = f"manual_embedding/{year}/Q{quarter[-1]}/manual_vectors.pkl"
-    serialized = pickle.dumps(data)
+def load_manual_index(year, quarter):
+    """
+    Return {"vectors": (n, d) float32 memmap, "columns": {name: array}}.
 
-    s3.put_object(
-        Bucket=BUCKET_NAME,
-        Key=pickle_path,
-        Body=serialized
+    Served from the process-wide index cache; the shard is re-downloaded to
+    MANUAL_INDEX_DIR and memory-mapped only when its S3 ETag has changed.
+    """
+    key = f"{manual_index_prefix(year, quarter)}/vectors.npy"
+    return index_cache.get(
+        key,
+        fetch_etag=lambda: _manual_index_etag(year, quarter),
+        load=lambda: _fetch_manual_index(year, quarter),
     )
-    print(f"✅ Uploaded manual vectors to S3: s3://{BUCKET_NAME}/{pickle_path}")
 
-# ========== S3 DOWNLOAD ==========
+# ========== SHARDED SEGMENT STORE ==========
+# manual_embedding/{year}/Q{n}/manifest.json lists immutable segments, one or
+# more per (parser, strategy):
+#   {"segments": [{"id", "parser", "strategy", "prefix", "rows", "created", "deleted"?}],
+#    "retired": [{"prefix", "retired_at"}]}
+# Each segment is a columnar index under .../segments/{parser}_{strategy}/{id}/.
+# Appending never rewrites existing segments: for duplicate ids the newest
+# segment wins (upsert), a segment's "deleted" ids hide those rows in older
+# segments, and mode="replace" retires the group's older segments.
+# compact_segments merges small segments and deletes retired objects once
+# RETIRED_GRACE_SECONDS have passed, so readers on an older manifest still work.
+
+COMPACT_SMALL_ROWS = int(os.getenv("MANUAL_COMPACT_SMALL_ROWS", 256))
+COMPACT_MIN_SEGMENTS = int(os.getenv("MANUAL_COMPACT_MIN_SEGMENTS", 2))
+RETIRED_GRACE_SECONDS = int(os.getenv("MANUAL_RETIRED_GRACE_SECONDS", 3600))
+_manifest_lock = threading.Lock()
+
+def bm25_location(year, quarter, parser, strategy):
+    return ("s3", f"{manual_index_prefix(year, quarter)}/bm25/{parser}_{strategy}.json.gz")
+
+def manifest_key(year, quarter):
+    return f"{manual_index_prefix(year, quarter)}/manifest.json"
+
+def _read_manifest(key):
+    try:
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return {"segments": [], "retired": []}, None
+    return json.loads(response["Body"].read()), response["ETag"]
+
+def _write_manifest(key, manifest):
+    s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=json.dumps(manifest, indent=1), ContentType="application/json")
+    index_cache.invalidate(key)
+
+def load_manifest(year, quarter):
+    key = manifest_key(year, quarter)
+
+    def load():
+        manifest, etag = _read_manifest(key)
+        return manifest, etag, len(json.dumps(manifest))
+
+    return index_cache.get(key, fetch_etag=lambda: _object_etag(key), load=load)
+
+def _retire_segments(manifest, predicate):
+    now = time.time()
+    kept = []
+    for segment in manifest["segments"]:
+        if predicate(segment):
+            manifest["retired"].append({"prefix": segment["prefix"], "retired_at": now})
+        else:
+            kept.append(segment)
+    manifest["segments"] = kept
+
+def _write_segment(vectors, columns, year, quarter, parser, strategy):
+    segment_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    prefix = f"{manual_index_prefix(year, quarter)}/segments/{parser}_{strategy}/{segment_id}"
+    _put_columnar(prefix, vectors, columns)
+    return {
+        "id": segment_id,
+        "parser": parser,
+        "strategy": strategy,
+        "prefix": prefix,
+        "rows": int(vectors.shape[0]),
+        "created": time.time(),
+    }
+
+def append_segment(data, year, quarter, parser, strategy, mode="upsert", deleted=()):
+    """
+    Write `data` (manual vector entries) as a new segment and register it.
+    mode="upsert" layers it over existing segments, hiding `deleted` ids in
+    them; mode="replace" retires the (parser, strategy) group's previous segments.
+    """
+    if mode not in ("upsert", "replace"):
+        raise ValueError("mode must be 'upsert' or 'replace'.")
+
+    entry = _write_segment(*build_columnar_index(data), year, quarter, parser, strategy)
+    if deleted and mode == "upsert":
+        entry["deleted"] = list(deleted)
+    key = manifest_key(year, quarter)
+    with _manifest_lock:
+        manifest, _ = _read_manifest(key)
+        if mode == "replace":
+            _retire_segments(manifest, lambda s: s["parser"] == parser and s["strategy"] == strategy)
+        manifest["segments"].append(entry)
+        _write_manifest(key, manifest)
+
+    print(f"✅ Added manual segment s3://{BUCKET_NAME}/{entry['prefix']}/ ({entry['rows']} vectors, {mode})")
+    return entry
+
+def load_segment(entry):
+    # Segments are immutable, so the segment id stands in for its ETag
+    key = f"{entry['prefix']}/vectors.npy"
+
+    def load():
+        index, size = _load_segment_index(entry["prefix"])
+        if isinstance(index["vectors"], RemoteRows):
+            # Rows fetched for rescoring count towards the shard's cache size
+            index["vectors"].on_resize = lambda cached: index_cache.resize(key, index, size + cached)
+        return index, entry["id"], size
+
+    return index_cache.get(key, fetch_etag=lambda: entry["id"], load=load)
+
+def _live_segments(segments):
+    """Return [(index, live_mask)] oldest first, masking rows upserted or deleted by a newer segment."""
+    seen, live = set(), []
+    for entry in reversed(segments):
+        index = load_segment(entry)
+        ids = index["columns"]["ids"]
+        mask = ~np.isin(ids, list(seen)) if seen else np.ones(len(ids), dtype=bool)
+        seen.update(ids.tolist())
+        seen.update(entry.get("deleted", []))
+        live.append((index, mask))
+    return live[::-1]
+
+def _candidate_indexes(parser, strategy, year, quarter):
+    segments = [
+        s for s in load_manifest(year, quarter)["segments"]
+        if s["parser"] == parser and s["strategy"] == strategy
+    ]
+    if segments:
+        return _live_segments(segments)
+
+    # Nothing in the segment store yet: use the older single index for the quarter
+    index = load_manual_index(year, quarter)
+    return [(index, filter_mask(index["columns"], parser=parser, strategy=strategy, year=year, quarter=quarter))]
+
+def _delete_prefix(prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=f"{prefix}/"):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": objects})
+
+def compact_segments(year, quarter):
+    """
+    Merge each (parser, strategy) group that has COMPACT_MIN_SEGMENTS or more
+    small segments into a single segment, and purge retired segments.
+    """
+    key = manifest_key(year, quarter)
+    with _manifest_lock:
+        manifest, _ = _read_manifest(key)
+        changed = False
+
+        groups = {}
+        for segment in manifest["segments"]:
+            groups.setdefault((segment["parser"], segment["strategy"]), []).append(segment)
+
+        for (parser, strategy), segments in groups.items():
+            small = [s for s in segments if s["rows"] < COMPACT_SMALL_ROWS]
+            if len(segments) < 2 or len(small) < COMPACT_MIN_SEGMENTS:
+                continue
+
+            # Merge the whole group so newest-wins order is kept
+            live = [(index, mask) for index, mask in _live_segments(segments) if mask.any()]
+            vectors = np.concatenate([index["vectors"][mask] for index, mask in live]) if live else np.zeros((0, 0), dtype=np.float32)
+            columns = {
+                name: [value for index, mask in live for value in index["columns"][name][mask].tolist()]
+                for name in ["ids", *META_COLUMNS]
+            }
+            merged = _write_segment(vectors, columns, year, quarter, parser, strategy)
+
+            merged_ids = {s["id"] for s in segments}
+            _retire_segments(manifest, lambda s: s["id"] in merged_ids)
+            manifest["segments"].append(merged)
+            changed = True
+            print(f"🗜️ Compacted {len(segments)} segments of {parser}_{strategy} into {merged['rows']} vectors")
+
+        now = time.time()
+        kept = []
+        for retired in manifest["retired"]:
+            if now - retired["retired_at"] >= RETIRED_GRACE_SECONDS:
+                _delete_prefix(retired["prefix"])
+                changed = True
+            else:
+                kept.append(retired)
+        manifest["retired"] = kept
+
+        if changed:
+            _write_manifest(key, manifest)
+    return manifest
+
+# ========== CORPUS-WIDE ANN INDEX ==========
+# One IVF index (embedding/ann.py) over the live rows of every segment in every
+# quarter, stored under manual_embedding/ann/. It records the segment ids it
+# was built from and is rebuilt in the background after manual ingestion, but
+# only when those ids no longer match the manifests.
+
+ANN_PREFIX = "manual_embedding/ann"
+ANN_FILES = ["vectors.npy", "ivf.npz", "meta.json.gz"]
+
+def _manifest_keys():
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix="manual_embedding/"):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith("/manifest.json"):
+                yield obj["Key"]
+
+def _ann_sources():
+    # ivf.npz holds only centroids, list offsets and sources, so this skips the vectors
+    try:
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=f"{ANN_PREFIX}/ivf.npz")
+    except s3.exceptions.NoSuchKey:
+        return None
+    with np.load(io.BytesIO(response["Body"].read()), allow_pickle=False) as ivf:
+        return set(ivf["sources"].tolist())
+
+def build_manual_ann_index(nlist=None, force=False):
+    """
+    Rebuild the corpus-wide ANN index from the live segment rows. Skipped
+    (returns None) when the stored index was built from exactly the segments
+    the manifests list now, unless force=True.
+    """
+    groups = {}
+    for key in _manifest_keys():
+        manifest, _ = _read_manifest(key)
+        for segment in manifest["segments"]:
+            groups.setdefault((key, segment["parser"], segment["strategy"]), []).append(segment)
+    sources = [segment["id"] for segments in groups.values() for segment in segments]
+
+    if not force and sources and _ann_sources() == set(sources):
+        print("✅ Manual ANN index is up to date.")
+        return None
+
+    parts, columns = [], {name: [] for name in ["ids", *META_COLUMNS]}
+    for segments in groups.values():
+        for index, mask in _live_segments(segments):
+            if not mask.any():
+                continue
+            parts.append(index["vectors"][mask])
+            for name in columns:
+                columns[name].extend(index["columns"][name][mask].tolist())
+
+    if not parts:
+        print("⚠️ No manual segments to index.")
+        return None
+
+    ann = IVFIndex.build(np.concatenate(parts), columns, nlist=nlist, sources=sources)
+    local_dir = os.path.join(MANUAL_INDEX_DIR, f"{ANN_PREFIX}_build")
+    ann.save(local_dir)
+    for name in ANN_FILES:
+        s3.upload_file(os.path.join(local_dir, name), BUCKET_NAME, f"{ANN_PREFIX}/{name}")
+    index_cache.invalidate(f"{ANN_PREFIX}/ivf.npz")
+    print(f"✅ Built manual ANN index: {ann.vectors.shape[0]} vectors in {ann.centroids.shape[0]} lists")
+    return ann
+
+def load_manual_ann_index():
+    """Return the corpus-wide IVFIndex (memory-mapped), or None if it was never built."""
+    key = f"{ANN_PREFIX}/ivf.npz"
+
+    def load():
+        etag = _object_etag(key)
+        if etag is None:
+            return None, None, 0
+        local_dir = os.path.join(MANUAL_INDEX_DIR, ANN_PREFIX)
+        os.makedirs(local_dir, exist_ok=True)
+        for name in ANN_FILES:
+            s3.download_file(BUCKET_NAME, f"{ANN_PREFIX}/{name}", os.path.join(local_dir, name))
+        ann = IVFIndex.load(local_dir)
+        return ann, etag, ann.nbytes
+
+    return index_cache.get(key, fetch_etag=lambda: _object_etag(key), load=load)
+
+def filter_mask(columns, **filters):
+    mask = np.ones(len(columns["ids"]), dtype=bool)
+    for name, value in filters.items():
+        mask &= columns[name] == value
+    return mask
+
+def top_k_indices(scores, k):
+    # argpartition finds the top k in O(n); only those k are then sorted.
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+# ========== S3 DOWNLOAD (legacy pickle) ==========
 def download_pickle_from_s3(year, quarter):
     pickle_path = f"manual_embedding/{year}/Q{quarter[-1]}/manual_vectors.pkl"
 
@@ -90,45 +594,106 @@ def download_pickle_from_s3(year, quarter):
         raise RuntimeError(f"Failed to load vectors from S3: {str(e)}")
 
 # ========== COSINE SIMILARITY SEARCH ==========
-def search_manual_vectors(query, parser, strategy, year, quarter, top_k=5):
-    query_vector = generate_embeddings([query])[0]
-    all_data = download_pickle_from_s3(year, quarter)
-
-    # Filter vectors by metadata
-    filtered = [
-        entry for entry in all_data
-        if entry['meta']['parser'] == parser and
-           entry['meta']['strategy'] == strategy and
-           entry['meta']['year'] == year and
-           entry['meta']['quarter'] == quarter
-    ]
+def search_manual_vectors(query, parser, strategy, year, quarter, top_k=5, nprobe=None, mode="vector", query_vector=None):
+    """
+    Exact search over one quarter's segments when year and quarter are given;
+    with year and/or quarter set to None, search every ingested filing through
+    the ANN index (nprobe trades recall for latency, see embedding/ann.py).
+    mode="lexical" (one quarter only) uses the BM25 index and skips the query
+    embedding; mode="hybrid" fuses both rankings. A precomputed `query_vector`
+    skips the embedding call.
+    """
+    check_mode(mode)
+    if mode != "vector" and (year is None or quarter is None):
+        raise ValueError("Lexical and hybrid search need a year and quarter.")
+    if mode == "lexical":
+        bm25 = load_bm25(bm25_location(year, quarter, parser, strategy))
+        if bm25 is None:
+            raise FileNotFoundError("❌ No BM25 index found; re-run the manual upload.")
+        return [text for _, text in bm25.search(query, top_k)]
+    if mode == "hybrid":
+        return rrf_fuse([
+            search_manual_vectors(query, parser, strategy, year, quarter, 2 * top_k, nprobe, "vector", query_vector),
+            search_manual_vectors(query, parser, strategy, year, quarter, 2 * top_k, nprobe, "lexical"),
+        ], top_k)
+
+    if query_vector is None:
+        query_vector = embed_query(query)
+    query_vector = normalize_rows(np.asarray(query_vector, dtype=np.float32))
+
+    if year is None or quarter is None:
+        ann = load_manual_ann_index()
+        if ann is None:
+            raise FileNotFoundError("❌ No manual ANN index found; run build_manual_ann_index().")
+        rows, _ = ann.query(query_vector, top_k, nprobe, parser=parser, strategy=strategy, year=year, quarter=quarter)
+        if rows.size == 0:
+            print("⚠️ No matching vectors found.")
+        return [str(ann.columns["content"][i]) for i in rows]
 
-    if not filtered:
+    candidates = _candidate_indexes(parser, strategy, year, quarter)
+    if not any(mask.any() for _, mask in candidates):
         print("⚠️ No matching vectors found.")
         return []
 
-    # Compute cosine similarities
-    stored_vectors = [entry["embedding"] for entry in filtered]
-    scores = cosine_similarity([query_vector], stored_vectors)[0]
+    # Rows are pre-normalized, so one matrix-vector product per segment gives cosine scores
+    hits = []
+    for index, mask in candidates:
+        if not mask.any():
+            continue
+        content = index["columns"]["content"]
+        if "quantized" in index:
+            rows, scores = index["quantized"].search(query_vector, top_k, index["vectors"], mask=mask)
+            hits.extend((float(score), str(content[i])) for i, score in zip(rows, scores))
+            continue
+        scores = np.where(mask, index["vectors"] @ query_vector, -np.inf)
+        for i in top_k_indices(scores, min(top_k, int(mask.sum()))):
+            hits.append((float(scores[i]), str(content[i])))
 
-    # Rank and return top chunks
-    top_indices = np.argsort(scores)[-top_k:][::-1]
-    return [filtered[i]["meta"]["content"] for i in top_indices]
+    # Merge per-segment top chunks into the global top k
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    return [text for _, text in hits[:top_k]]
+
+def search_manual_vectors_batch(query_vectors, parser, strategy, year, quarter, top_k=5):
+    """
+    Exact search of many queries over one quarter's segments: each segment is
+    scored against a block of queries with one matrix product. Returns one
+    list of chunk texts per query.
+    """
+    queries = normalize_rows(np.asarray(query_vectors, dtype=np.float32))
+    hits = [[] for _ in range(len(queries))]
+
+    for index, mask in _candidate_indexes(parser, strategy, year, quarter):
+        live = int(mask.sum())
+        if not live:
+            continue
+        content = index["columns"]["content"]
+        if "quantized" in index:
+            for q, query_vector in enumerate(queries):
+                rows, scores = index["quantized"].search(query_vector, top_k, index["vectors"], mask=mask)
+                hits[q].extend((float(score), str(content[i])) for i, score in zip(rows, scores))
+            continue
+        k = min(top_k, live)
+        for start in range(0, len(queries), BATCH_QUERY_BLOCK):
+            scores = queries[start:start + BATCH_QUERY_BLOCK] @ index["vectors"].T
+            scores[:, ~mask] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for offset, rows in enumerate(top):
+                hits[start + offset].extend((float(scores[offset, i]), str(content[i])) for i in rows)
+
+    if not any(hits):
+        print("⚠️ No matching vectors found.")
+    # Merge per-segment top chunks into each query's global top k
+    return [[text for _, text in sorted(query_hits, key=lambda hit: hit[0], reverse=True)[:top_k]] for query_hits in hits]
 
 # ========== SUMMARY FROM CHUNKS ==========
 def summarize_manual_chunks(parser, strategy, year, quarter, top_k=30):
-    all_data = download_pickle_from_s3(year, quarter)
-    filtered = [
-        entry for entry in all_data
-        if entry['meta']['parser'] == parser and
-           entry['meta']['strategy'] == strategy and
-           entry['meta']['year'] == year and
-           entry['meta']['quarter'] == quarter
-    ]
+    chunks = []
+    for index, mask in _candidate_indexes(parser, strategy, year, quarter):
+        content = index["columns"]["content"]
+        chunks.extend(str(content[i]) for i in np.flatnonzero(mask))
 
-    if not filtered:
+    if not chunks:
         print("⚠️ No matching data found for summary generation.")
         return []
 
-    chunks = [entry['meta']['content'] for entry in filtered[:top_k]]
-    return chunks
+    return chunks[:top_k]
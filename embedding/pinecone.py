@@ -1,9 +1,18 @@
 import os
+import json
+import time
+import threading
 import openai
 import boto3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 from pinecone import Pinecone
-from chunking.chunks import heading_based_split, semantic_split, recursive_split
+from chunking.artifacts import chunk_records
+from embedding.batcher import embed_batches
+from embedding.query_cache import embed_query
+from embedding.fanout import fan_out
+from embedding.ingest_diff import diff_chunks, diff_summary, save_ingest_state
+from embedding.bm25 import save_bm25, lexical_search, rrf_fuse, check_mode
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +24,14 @@ PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX")
 AWS_BUCKET = os.getenv("AWS_BUCKET_NAME")
 AWS_REGION = os.getenv("AWS_REGION")
 
+# Upserts are packed by estimated request size (Pinecone caps a request at
+# 2 MB and 1000 vectors) and several are kept in flight at once.
+UPSERT_MAX_BYTES = int(os.getenv("PINECONE_UPSERT_MAX_BYTES", 1_500_000))
+UPSERT_MAX_VECTORS = 1000
+UPSERT_CONCURRENCY = int(os.getenv("PINECONE_UPSERT_CONCURRENCY", 4))
+# Queries in flight at once for batch search
+QUERY_CONCURRENCY = int(os.getenv("PINECONE_QUERY_CONCURRENCY", 8))
+
 # Set OpenAI API Key
 openai.api_key = OPENAI_API_KEY
 
@@ -27,13 +44,22 @@ s3_client = boto3.client(
 )
 
 # Step 1: Connect to Existing Pinecone Index
+# One client and index handle per process; the handle's HTTP connection pool
+# is shared by every upload and query.
+_pinecone_index = None
+_pinecone_lock = threading.Lock()
+
 def connect_pinecone_index():
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    try:
-        return pc.Index(PINECONE_INDEX_NAME)
-    except Exception as e:
-        print(f"❌ Could not connect to Pinecone index '{PINECONE_INDEX_NAME}': {e}")
-        raise
+    global _pinecone_index
+    with _pinecone_lock:
+        if _pinecone_index is None:
+            pc = Pinecone(api_key=PINECONE_API_KEY)
+            try:
+                _pinecone_index = pc.Index(PINECONE_INDEX_NAME, pool_threads=UPSERT_CONCURRENCY)
+            except Exception as e:
+                print(f"❌ Could not connect to Pinecone index '{PINECONE_INDEX_NAME}': {e}")
+                raise
+        return _pinecone_index
 
 # Step 2: Get .md content from S3
 def load_markdown(year: str, quarter: str, parser: str) -> str:
@@ -45,47 +71,165 @@ def load_markdown(year: str, quarter: str, parser: str) -> str:
         print(f"❌ Could not load {key} from S3: {e}")
         return None
 
-# Step 3: Embed text using OpenAI
-def get_openai_embedding(text: str) -> list:
-    response = openai.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return response.data[0].embedding
+# Step 3: Upload to Pinecone
+class UpsertStats:
+    def __init__(self):
+        self.vectors = 0
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.last_run = None
+        self._lock = threading.Lock()
 
-# Step 4: Upload to Pinecone
-def upload_to_pinecone(parser, strategy, year, quarter, chunks):
-    index = connect_pinecone_index()
-    namespace = f"{parser}_{strategy}"
-    batch = []
+    def record(self, vectors, size, seconds):
+        with self._lock:
+            self.vectors += vectors
+            self.requests += 1
+            self.bytes += size
+            self.seconds += seconds
+
+    def record_run(self, vectors, seconds):
+        with self._lock:
+            self.last_run = {"vectors": vectors, "seconds": round(seconds, 3),
+                             "vectors_per_sec": round(vectors / seconds, 1) if seconds else 0.0}
 
-    for i, chunk in enumerate(chunks):
-        vector_id = f"{year}_{quarter}_{parser}_{strategy}_{i}"
-        embedding = get_openai_embedding(chunk)
-        metadata = {"year": year, "quarter": quarter, "text": chunk}
-        batch.append((vector_id, embedding, metadata))
+    def stats(self):
+        with self._lock:
+            return {
+                "vectors": self.vectors,
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "request_seconds": round(self.seconds, 3),
+                # Per request; concurrent upserts make wall-clock throughput (last_run) higher
+                "vectors_per_request_sec": round(self.vectors / self.seconds, 1) if self.seconds else 0.0,
+                "last_run": self.last_run,
+            }
 
-        if len(batch) >= 20:
-            index.upsert(vectors=batch, namespace=namespace)
-            print(f"🔼 Uploaded {len(batch)} chunks.")
-            batch.clear()
+upsert_stats = UpsertStats()
 
+def _payload_bytes(vector):
+    # JSON-ish estimate: ~12 bytes per float plus the id and metadata
+    vector_id, values, metadata = vector
+    return len(vector_id) + 12 * len(values) + len(json.dumps(metadata).encode("utf-8")) + 64
+
+def pack_upserts(vectors, max_bytes=UPSERT_MAX_BYTES, max_vectors=UPSERT_MAX_VECTORS):
+    """Lazily group (id, values, metadata) tuples into (batch, size) upsert requests."""
+    batch, batch_bytes = [], 0
+    for vector in vectors:
+        size = _payload_bytes(vector)
+        if batch and (len(batch) >= max_vectors or batch_bytes + size > max_bytes):
+            yield batch, batch_bytes
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += size
     if batch:
+        yield batch, batch_bytes
+
+def upsert_vectors(index, vectors, namespace, concurrency=None):
+    """Upsert size-packed batches with at most `concurrency` requests in flight; returns the count."""
+    concurrency = concurrency or UPSERT_CONCURRENCY
+    window_start = time.perf_counter()
+    uploaded = 0
+
+    def send(batch, size):
+        start = time.perf_counter()
         index.upsert(vectors=batch, namespace=namespace)
-        print(f"🔼 Uploaded final {len(batch)} chunks.")
+        upsert_stats.record(len(batch), size, time.perf_counter() - start)
+        return len(batch)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for batch, size in pack_upserts(vectors):
+            pending.add(pool.submit(send, batch, size))
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                uploaded += sum(future.result() for future in done)
+        uploaded += sum(future.result() for future in pending)
 
-# Step 5: Query Pinecone
-def search_chunks(parser, strategy, query, year, quarters, top_k=5):
+    elapsed = time.perf_counter() - window_start
+    upsert_stats.record_run(uploaded, elapsed)
+    print(f"🔼 Upserted {uploaded} vectors in {elapsed:.1f}s ({uploaded / elapsed if elapsed else 0:.0f} vectors/sec)")
+    return uploaded
+
+# `records` carry ids from embedding.ingest_diff and may be a lazy iterator.
+# Chunks are embedded in token-packed requests (several in flight at once) and
+# upserted in size-packed requests as embeddings arrive.
+def upload_to_pinecone(parser, strategy, year, quarter, records, max_chars=15000):
     index = connect_pinecone_index()
-    embedded_query = get_openai_embedding(query)
-    results = index.query(
-        namespace=f"{parser}_{strategy}",
-        vector=embedded_query,
-        top_k=top_k,
-        include_metadata=True,
-        filter={"year": {"$eq": year}, "quarter": {"$in": quarters}},
+    namespace = f"{parser}_{strategy}"
+
+    chunks = ((record["id"], record["text"][:max_chars]) for record in records)
+    vectors = (
+        (vector_id, embedding, {"year": year, "quarter": quarter, "text": chunk})
+        for (vector_id, chunk), embedding in embed_batches(chunks, text_of=lambda item: item[1])
     )
-    return [match["metadata"]["text"] for match in results["matches"]]
+    return upsert_vectors(index, vectors, namespace)
+
+def delete_vectors(index, ids, namespace, batch_size=1000):
+    for start in range(0, len(ids), batch_size):
+        index.delete(ids=ids[start:start + batch_size], namespace=namespace)
+    if ids:
+        print(f"🗑️ Deleted {len(ids)} stale vectors from {namespace}")
+
+def purge_untracked_vectors(index, namespace, prefix):
+    # Vectors written before ingest state was tracked; listing by id prefix
+    # needs a serverless index, so this is best effort.
+    try:
+        for ids in index.list(prefix=prefix, namespace=namespace):
+            delete_vectors(index, list(ids), namespace)
+    except Exception as e:
+        print(f"⚠️ Could not list vectors with prefix {prefix} for cleanup: {e}")
+
+def bm25_location(year, quarter, parser, strategy):
+    return ("s3", f"bm25/pinecone/{year}/{quarter}/{parser}_{strategy}.json.gz")
+
+# Step 4: Query Pinecone
+# Each quarter is queried as its own shard, concurrently, and merged into a
+# global top_k by score (see embedding/fanout.py). mode="lexical" answers from
+# the BM25 index without embedding the query; "hybrid" fuses both rankings.
+def search_chunks(parser, strategy, query, year, quarters, top_k=5, mode="vector", query_vector=None):
+    check_mode(mode)
+    if mode == "lexical":
+        return lexical_search(lambda quarter: bm25_location(year, quarter, parser, strategy), query, quarters, top_k)
+    if mode == "hybrid":
+        return rrf_fuse([
+            search_chunks(parser, strategy, query, year, quarters, 2 * top_k, "vector", query_vector),
+            search_chunks(parser, strategy, query, year, quarters, 2 * top_k, "lexical"),
+        ], top_k)
+
+    index = connect_pinecone_index()
+    embedded_query = query_vector if query_vector is not None else embed_query(query)
+
+    def search_quarter(quarter):
+        results = index.query(
+            namespace=f"{parser}_{strategy}",
+            vector=embedded_query,
+            top_k=top_k,
+            include_metadata=True,
+            filter={"year": {"$eq": year}, "quarter": {"$eq": quarter}},
+        )
+        return [(match["score"], match["metadata"]["text"]) for match in results["matches"]]
+
+    return fan_out(quarters, search_quarter, top_k)
+
+# Many questions against one filing. Pinecone has no multi-vector query, so
+# each vector is its own request, QUERY_CONCURRENCY at a time over the shared
+# index handle. Returns one list of chunk texts per query vector.
+def search_chunks_batch(parser, strategy, query_vectors, year, quarter, top_k=5, concurrency=None):
+    index = connect_pinecone_index()
+
+    def search_vector(vector):
+        results = index.query(
+            namespace=f"{parser}_{strategy}",
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            filter={"year": {"$eq": year}, "quarter": {"$eq": quarter}},
+        )
+        return [match["metadata"]["text"] for match in results["matches"]]
+
+    with ThreadPoolExecutor(max_workers=concurrency or QUERY_CONCURRENCY) as pool:
+        return list(pool.map(search_vector, query_vectors))
 
 
 def process_and_upload_to_pinecone(year, quarter, parser, strategy):
@@ -96,38 +240,33 @@ def process_and_upload_to_pinecone(year, quarter, parser, strategy):
     if not markdown:
         raise ValueError("❌ Markdown file could not be loaded from S3.")
 
-    # Step 2: Chunk Markdown
+    # Step 2: Chunk Markdown (stored artifact if present, else lazily so embedding starts with the first chunk)
     try:
-        if strategy == "heading":
-            chunks = heading_based_split(markdown)
-        elif strategy == "semantic":
-            chunks = semantic_split(markdown)
-        elif strategy == "recursive":
-            chunks = recursive_split(markdown)
-        else:
-            raise ValueError("❌ Invalid chunking strategy.")
+        records = chunk_records(markdown, year, quarter, parser, strategy)
     except Exception as e:
         print("❌ Error while chunking:", e)
         raise ValueError(f"Error during chunking: {e}")
 
-    print(f"✅ Total chunks created: {len(chunks)}")
-
-    
-    max_chars = 15000
-    chunks = [chunk[:max_chars] for chunk in chunks]
-
-    # Step 3: Upload to Pinecone
+    # Step 3: Diff against what is already stored, then upload and delete only the changes
     try:
-        print("🚀 Uploading chunks to Pinecone...")
-        upload_to_pinecone(parser, strategy, year, quarter, chunks)
-        print("✅ Upload to Pinecone successful.")
+        diff = diff_chunks("pinecone", records, year, quarter, parser, strategy)
+        index = connect_pinecone_index()
+        namespace = f"{parser}_{strategy}"
+        if diff.first_run:
+            purge_untracked_vectors(index, namespace, f"{year}_{quarter}_{parser}_{strategy}_")
+        print("🚀 Streaming changed chunks to Pinecone...")
+        uploaded = upload_to_pinecone(parser, strategy, year, quarter, diff.added)
+        delete_vectors(index, diff.removed, namespace)
+        save_bm25([text[:15000] for text in diff.texts], bm25_location(year, quarter, parser, strategy))
+        save_ingest_state("pinecone", year, quarter, parser, strategy, diff.ids)
+        print(f"✅ Upload to Pinecone successful. Chunks upserted: {uploaded}")
     except Exception as e:
         print("❌ Pinecone upload failed:")
         import traceback
         traceback.print_exc()
         raise ValueError(f"Pinecone upload error: {e}")
 
-    return {"status": "success", "chunks_uploaded": len(chunks)}
+    return {"status": "success", **diff_summary(diff)}
 
 
 
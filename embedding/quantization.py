@@ -0,0 +1,163 @@
+import os
+import io
+import argparse
+import numpy as np
+
+# Quantized first-pass search for the manual store.
+#
+#   int8   - symmetric per-dimension scalar quantization (4x smaller than float32)
+#   binary - one sign bit per dimension, compared by Hamming distance (32x smaller)
+#
+# The codes are kept in memory and scanned in full; the best
+# top_k * oversample candidates are then rescored exactly against the
+# full-precision vectors. The manual store writes the codes as their own
+# segment object, so a segment loads just the codes and reads full-precision
+# rows from S3 only for the candidates it rescores.
+
+MANUAL_QUANTIZATION = os.getenv("MANUAL_QUANTIZATION", "none")
+# Sign bits lose far more ranking detail than int8, so binary rescoring looks deeper
+QUANTIZATION_OVERSAMPLE = {
+    "int8": int(os.getenv("MANUAL_INT8_OVERSAMPLE", 4)),
+    "binary": int(os.getenv("MANUAL_BINARY_OVERSAMPLE", 10)),
+}
+QUANTIZATION_KINDS = tuple(QUANTIZATION_OVERSAMPLE)
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_BLOCK_ROWS = 16384
+
+class QuantizedIndex:
+    def __init__(self, kind, codes, scale=None):
+        self.kind = kind
+        self.codes = codes
+        self.scale = scale
+
+    @classmethod
+    def build(cls, vectors, kind):
+        if kind not in QUANTIZATION_KINDS:
+            raise ValueError(f"Unknown quantization: {kind}")
+        n, d = vectors.shape
+        scale = None
+        if kind == "binary":
+            codes = np.empty((n, (d + 7) // 8), dtype=np.uint8)
+        else:
+            codes = np.empty((n, d), dtype=np.int8)
+            scale = np.zeros(d, dtype=np.float32)
+            for start in range(0, n, _BLOCK_ROWS):
+                block = np.abs(np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32))
+                scale = np.maximum(scale, block.max(axis=0))
+            scale = scale / 127.0
+            scale[scale == 0] = 1.0
+
+        # Blockwise so memory-mapped vectors are streamed, not loaded whole
+        for start in range(0, n, _BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+            if kind == "binary":
+                codes[start:start + _BLOCK_ROWS] = np.packbits(block > 0, axis=1)
+            else:
+                codes[start:start + _BLOCK_ROWS] = np.clip(np.rint(block / scale), -127, 127)
+        return cls(kind, codes, scale)
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        arrays = {"codes": self.codes} if self.scale is None else {"codes": self.codes, "scale": self.scale}
+        np.savez(buffer, kind=np.array(self.kind), **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as stored:
+            return cls(str(stored["kind"]), stored["codes"], stored["scale"] if "scale" in stored else None)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def approximate_scores(self, query):
+        """Higher is better; only the ranking matters, not the scale."""
+        scores = np.empty(self.codes.shape[0], dtype=np.float32)
+        if self.kind == "binary":
+            query_code = np.packbits(query > 0)
+            for start in range(0, self.codes.shape[0], _BLOCK_ROWS):
+                xor = np.bitwise_xor(self.codes[start:start + _BLOCK_ROWS], query_code)
+                scores[start:start + _BLOCK_ROWS] = -_POPCOUNT[xor].sum(axis=1, dtype=np.int32)
+        else:
+            scaled_query = (query * self.scale).astype(np.float32)
+            for start in range(0, self.codes.shape[0], _BLOCK_ROWS):
+                scores[start:start + _BLOCK_ROWS] = self.codes[start:start + _BLOCK_ROWS].astype(np.float32) @ scaled_query
+        return scores
+
+    def search(self, query, top_k, vectors, mask=None, oversample=None):
+        """
+        Return (rows, exact_scores) of the top_k rows, best first. `vectors`
+        are the full-precision rows used for rescoring.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        scores = self.approximate_scores(query)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            available = int(mask.sum())
+        else:
+            available = scores.shape[0]
+
+        candidates = min(top_k * (oversample or QUANTIZATION_OVERSAMPLE[self.kind]), available)
+        if candidates <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.sort(np.argpartition(-scores, candidates - 1)[:candidates])
+
+        exact = np.asarray(vectors[rows], dtype=np.float32) @ query
+        k = min(top_k, rows.size)
+        top = np.argpartition(-exact, k - 1)[:k]
+        top = top[np.argsort(-exact[top])]
+        return rows[top], exact[top]
+
+def evaluate_quantization(vectors, queries, k=10, oversample=None):
+    """
+    Compare int8 and binary first-pass search (with exact rescoring) against
+    exact search. Returns {kind: {"bytes", "saved_pct", "recall_at_k"}}.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    full_bytes = vectors.nbytes
+    exact_sets = []
+    for query in queries:
+        scores = vectors @ query
+        exact_sets.append(set(np.argpartition(-scores, min(k, len(scores)) - 1)[:k].tolist()))
+
+    report = {"float32": {"bytes": full_bytes, "saved_pct": 0.0, "recall_at_k": 1.0}}
+    for kind in QUANTIZATION_KINDS:
+        quantized = QuantizedIndex.build(vectors, kind)
+        hits = 0
+        for query, exact in zip(queries, exact_sets):
+            rows, _ = quantized.search(query, k, vectors, oversample=oversample)
+            hits += len(exact & set(rows.tolist()))
+        report[kind] = {
+            "bytes": quantized.nbytes,
+            "saved_pct": round(100 * (1 - quantized.nbytes / full_bytes), 2) if full_bytes else 0.0,
+            "recall_at_k": round(hits / max(1, len(queries) * k), 4),
+        }
+    return report
+
+if __name__ == "__main__":
+    from embedding.manual import _candidate_indexes
+
+    parser = argparse.ArgumentParser(description="Report memory saved and recall@k of quantized manual-store search.")
+    parser.add_argument("--year", required=True)
+    parser.add_argument("--quarter", required=True)
+    parser.add_argument("--parser", default="docling")
+    parser.add_argument("--strategy", default="heading")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100, help="Stored chunks (plus noise) used as queries.")
+    parser.add_argument("--oversample", type=int, default=None)
+    args = parser.parse_args()
+
+    vectors = np.concatenate([
+        np.asarray(index["vectors"][mask], dtype=np.float32)
+        for index, mask in _candidate_indexes(args.parser, args.strategy, args.year, args.quarter)
+    ])
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(scale=0.02, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"📊 {len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    for kind, row in evaluate_quantization(vectors, queries, args.k, args.oversample).items():
+        print(f"🔹 {kind:8s} {row['bytes'] / 1e6:8.2f} MB  saved {row['saved_pct']:6.2f}%  recall@{args.k} {row['recall_at_k']:.4f}")
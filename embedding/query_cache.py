@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from embedding.batcher import EMBEDDING_MODEL, MAX_INPUTS_PER_REQUEST, request_embeddings
+
+# In-process LRU + TTL cache for query embeddings, shared by the Pinecone,
+# ChromaDB and manual retrieval paths. Fixed probe strings (the summary
+# endpoints always search for "summary") are embedded once at startup.
+# The backend embeds through embed_queries_async with its AsyncOpenAI client,
+# so a request never holds a thread while the embeddings API answers.
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+SUMMARY_PROBES = ("summary",)
+
+class QueryEmbeddingCache:
+    def __init__(self, max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pinned:
+                self.hits += 1
+                return self._pinned[key]
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, vector, pinned=False):
+        with self._lock:
+            if pinned:
+                self._pinned[key] = vector
+                return
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+            }
+
+query_cache = QueryEmbeddingCache()
+
+def embed_query(query, model=EMBEDDING_MODEL):
+    key = (model, query)
+    vector = query_cache.get(key)
+    if vector is None:
+        vector = request_embeddings([query], model)[0]
+        query_cache.put(key, vector)
+    return vector
+
+def embed_queries(queries, model=EMBEDDING_MODEL):
+    """Embed many queries at once: uncached ones go out in a single request (per 2048 inputs)."""
+    vectors = [query_cache.get((model, query)) for query in queries]
+    missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+    fresh = {}
+    for start in range(0, len(missing), MAX_INPUTS_PER_REQUEST):
+        batch = missing[start:start + MAX_INPUTS_PER_REQUEST]
+        for query, vector in zip(batch, request_embeddings(batch, model)):
+            query_cache.put((model, query), vector)
+            fresh[query] = vector
+    return [vector if vector is not None else fresh[query] for query, vector in zip(queries, vectors)]
+
+async def embed_queries_async(client, queries, model=EMBEDDING_MODEL):
+    """embed_queries through an async OpenAI client."""
+    vectors = [query_cache.get((model, query)) for query in queries]
+    missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+    fresh = {}
+    for start in range(0, len(missing), MAX_INPUTS_PER_REQUEST):
+        batch = missing[start:start + MAX_INPUTS_PER_REQUEST]
+        response = await client.embeddings.create(model=model, input=batch)
+        for query, item in zip(batch, sorted(response.data, key=lambda item: item.index)):
+            query_cache.put((model, query), item.embedding)
+            fresh[query] = item.embedding
+    return [vector if vector is not None else fresh[query] for query, vector in zip(queries, vectors)]
+
+async def embed_query_async(client, query, model=EMBEDDING_MODEL):
+    return (await embed_queries_async(client, [query], model))[0]
+
+def warm_query_cache(probes=SUMMARY_PROBES, model=EMBEDDING_MODEL):
+    # Pinned entries never expire, so summary requests never embed their probe.
+    vectors = request_embeddings(list(probes), model)
+    for probe, vector in zip(probes, vectors):
+        query_cache.put((model, probe), vector, pinned=True)
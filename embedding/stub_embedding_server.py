@@ -0,0 +1,69 @@
+import json
+import time
+import argparse
+import hashlib
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal stand-in for the OpenAI embeddings API, for exercising the embedding
+# batcher without network calls:
+#   python -m embedding.stub_embedding_server --port 8100 --delay 0.2
+#   OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub python ...
+# Vectors are deterministic per input text, so repeated runs are comparable.
+
+DEFAULT_DIMENSIONS = 1536
+
+def fake_embedding(text, dimensions):
+    seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    requests_served = 0
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = body.get("dimensions") or DEFAULT_DIMENSIONS
+
+        if self.delay:
+            time.sleep(self.delay)
+        EmbeddingHandler.requests_served += 1
+
+        payload = json.dumps({
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        print(f"🧪 request {EmbeddingHandler.requests_served}: {len(inputs)} inputs")
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stub of the OpenAI embeddings endpoint.")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds of simulated latency per request.")
+    args = parser.parse_args()
+
+    EmbeddingHandler.delay = args.delay
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), EmbeddingHandler)
+    print(f"🧪 Stub embedding server on http://localhost:{args.port}/v1/embeddings")
+    server.serve_forever()
@@ -1,11 +1,53 @@
 import streamlit as st
 import requests
+import json
 from datetime import datetime
 import time
 
 FASTAPI_URL = "http://fastapi_service:8000"
 AIRFLOW_URL = "http://airflow-webserver:8080/api/v1/dags/dag_rag_pipeline_triggered/dagRuns"
 
+def read_events(response):
+    """Yield (event, data) pairs from a server-sent event stream."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
+
+def stream_response(url, payload, title, failure):
+    """Render sources as soon as they arrive, then the answer token by token."""
+    start = time.time()
+    try:
+        with requests.post(url, json=payload, stream=True, timeout=(5, 300)) as response:
+            if response.status_code != 200:
+                st.error(failure)
+                return
+            st.success(title)
+            answer = st.empty()
+            text, first_token = "", 0.0
+            for event, data in read_events(response):
+                if event == "sources" and data["sources"]:
+                    with st.expander("📎 Context Used"):
+                        for i, chunk in enumerate(data["sources"], 1):
+                            st.markdown(f"**Chunk {i}:**\n\n```markdown\n{chunk}\n```")
+                elif event == "token":
+                    if not text:
+                        first_token = time.time() - start
+                    text += data["text"]
+                    answer.markdown(text + "▌")
+                elif event == "done":
+                    answer.markdown(text)
+                    st.caption(f"⏱️ First byte {data['ttfb_ms'] / 1000:.2f}s · first token {first_token:.2f}s · total {time.time() - start:.2f}s")
+                elif event == "error":
+                    st.error(f"{failure} {data['detail']}")
+    except requests.exceptions.RequestException as e:
+        st.error(f"{failure} {e}")
+
 st.set_page_config(page_title="NVIDIA RAG", layout="centered")
 st.sidebar.title("Navigation")
 page = st.sidebar.radio("Go to", ["🏠 Landing Page", "📄 Chat with LLM"])
@@ -68,24 +110,36 @@ elif page == "📄 Chat with LLM":
         if response.status_code == 200:
             st.success("✅ DAG triggered! Waiting for completion...")
 
-            # Poll FastAPI to check DAG status
+            # Long-poll FastAPI: each request returns as soon as the DAG state changes
             with st.spinner("⏳ Waiting for DAG to complete..."):
-                status_url = f"{FASTAPI_URL}/check_dag_status/{dag_run_id}"
-                max_retries = 12
-                for i in range(max_retries):
-                    status_response = requests.get(status_url)
-                    if status_response.status_code == 200:
-                        dag_status = status_response.json().get("status")
-                        if dag_status == "success":
-                            st.session_state.dag_complete = True
-                            st.success("🎉 DAG completed successfully!")
-                            break
-                        elif dag_status == "failed":
-                            st.error("❌ DAG run failed. Please check Airflow logs.")
+                status_url = f"{FASTAPI_URL}/dag_status/{dag_run_id}"
+                status_text = st.empty()
+                version, dag, failures = -1, {}, 0
+                while not dag.get("done"):
+                    try:
+                        status_response = requests.get(status_url, params={"version": version, "timeout": 25}, timeout=40)
+                        status_response.raise_for_status()
+                    except requests.exceptions.RequestException as e:
+                        failures += 1
+                        if failures >= 5:
+                            dag = {"state": "error", "detail": str(e)}
                             break
-                    time.sleep(5)
-                else:
+                        time.sleep(2)
+                        continue
+                    failures = 0
+                    dag = status_response.json()
+                    version = dag["version"]
+                    status_text.caption(f"DAG state: {dag['state'] or 'queued'}")
+
+                if dag["state"] == "success":
+                    st.session_state.dag_complete = True
+                    st.success("🎉 DAG completed successfully!")
+                elif dag["state"] == "failed":
+                    st.error("❌ DAG run failed. Please check Airflow logs.")
+                elif dag["state"] == "timeout":
                     st.warning("⏳ DAG is still running. Try again later.")
+                else:
+                    st.error(f"❌ Could not track DAG run: {dag['detail']}")
         else:
             st.error(f"❌ Failed to trigger DAG: {response.text}")
 
@@ -96,48 +150,37 @@ elif page == "📄 Chat with LLM":
 
         if query and st.button("🔍 Ask LLM"):
             route_map = {
-                "Pinecone": "/query_pinecone",
-                "ChromaDB": "/query_chromadb",
-                "Manual": "/query_manual"
+                "Pinecone": "/query_pinecone/stream",
+                "ChromaDB": "/query_chromadb/stream",
+                "Manual": "/query_manual/stream"
             }
-            response = requests.post(
+            stream_response(
                 f"{FASTAPI_URL}{route_map[st.session_state.vector_store]}",
-                json={
+                {
                     "query": query,
                     "year": st.session_state.year,
                     "quarter": st.session_state.quarter,
                     "parser": st.session_state.parser.lower(),
                     "strategy": st.session_state.strategy
-                }
+                },
+                "💬 LLM Response:",
+                "❌ Failed to get LLM response."
             )
-            if response.status_code == 200:
-                res = response.json()
-                st.success("💬 LLM Response:")
-                st.markdown(res["answer"])
-                with st.expander("📎 Context Used"):
-                    for i, chunk in enumerate(res["sources"], 1):
-                        st.markdown(f"**Chunk {i}:**\n\n```markdown\n{chunk}\n```")
-            else:
-                st.error("❌ Failed to get LLM response.")
 
         if st.button("🧾 Generate Summary"):
             route_map = {
-                "Pinecone": "/generate_summary_pinecone",
-                "ChromaDB": "/generate_summary_chromadb",
-                "Manual": "/generate_summary_manual"
+                "Pinecone": "/generate_summary_pinecone/stream",
+                "ChromaDB": "/generate_summary_chromadb/stream",
+                "Manual": "/generate_summary_manual/stream"
             }
-            response = requests.post(
+            stream_response(
                 f"{FASTAPI_URL}{route_map[st.session_state.vector_store]}",
-                json={
+                {
                     "year": st.session_state.year,
                     "quarter": st.session_state.quarter,
                     "parser": st.session_state.parser.lower(),
                     "strategy": st.session_state.strategy
-                }
-            )
-            if response.status_code == 200:
-                summary = response.json().get("summary", "")
-                st.success("📘 Summary:")
-                st.markdown(summary)
-            else:
-                st.error("❌ Failed to generate summary.")
\ No newline at end of file
+                },
+                "📘 Summary:",
+                "❌ Failed to generate summary."
+            )
\ No newline at end of file